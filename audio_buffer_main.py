@@ -1,30 +1,59 @@
+import asyncio
+from contextlib import asynccontextmanager
+from time import perf_counter
+
 import numpy as np
 import torch
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
+from fastapi.responses import PlainTextResponse
 
-from chat.tts.audio_buffer import AudioBuffer, Manager
+from chat.tts.audio_buffer import AudioBuffer
+from chat.tts.audio_maker import AudioMaker
+from chat.tts.audio_store import AudioStore
+from chat.tts.job_queue import JobQueue
 from utilities.colorize import color
+from utilities.http_pool import client_pool
+from utilities.metrics import CONTENT_TYPE, metrics
 from utilities.utilities import load_config
 from utilities.tts_utilities import (AudioFragment, MultipleAudioRequest,
                                     TextFragment, TextRequest)
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    if buffer is not None:
+        await buffer.stop_workers()
+    await client_pool.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 config = None
 buffer = None
-manager = None
+start_lock = asyncio.Lock()  # /start concorrenti non creano due buffer
+
+ingest_time = metrics.histogram(
+    "tts_ingest_seconds", "Time to split and enqueue a text received on /store_text"
+)
+decode_time = metrics.histogram(
+    "tts_audio_decode_seconds", "Time to decode the audio received on /store_audio"
+)
+bytes_transferred = metrics.counter(
+    "tts_audio_bytes_total", "PCM bytes received from the maker and audio bytes served"
+)
 
 
 @app.post("/store_text")  # Viene inviata dall'handler
 async def store_text(text: TextRequest):
     """Riceve un testo e avvia la generazione del frammento audio."""
     try:
-        data = TextFragment(text.text, text.id)
+        start = perf_counter()
+        data = TextFragment(text.text, text.id, request=text.request)
         chunks = buffer.split_text_into_chunks(data.text)
         for i, c in enumerate(chunks):
-            await buffer.add_text(TextFragment(c, text.id, i))
-        await buffer.send()
+            await buffer.add_text(TextFragment(c, text.id, i, text.request))
+        ingest_time.observe(perf_counter() - start)
         return {"status": "processing"}
     except Exception as e:
         print(color("[AUDIO BUFFER]", True, "red"), ": Error:", e)
@@ -34,30 +63,51 @@ async def store_text(text: TextRequest):
 @app.post("/store_audio")  # Viene inviata dal TTS
 async def store_audio(audio: MultipleAudioRequest):
     """Riceve un frammento audio e lo aggiunge al buffer."""
-    for a in audio.requests:
-        try:
+    try:
+        for a in audio.requests:
+            if a.error is not None:
+                buffer.fail_audio(a.request, a.id, a.sub_id, a.error)
+                continue
+            start = perf_counter()
             data = AudioFragment(
                 np.array([float(x) for x in a.content], dtype=np.float32),
                 a.id,
                 a.sub_id,
+                a.request,
             )
+            decode_time.observe(perf_counter() - start)
+            bytes_transferred.inc(data.content.nbytes, direction="received")
             await buffer.add_audio(data)
-            manager.remove_threads(1)
-            await buffer.send()
-            return {"status": "ok"}
-        except Exception as e:
-            print(color("[AUDIO BUFFER]", True, "red"), ": Error:", e)
-            return {"status": "error", "message": str(e)}
+        return {"status": "ok"}
+    except Exception as e:
+        print(color("[AUDIO BUFFER]", True, "red"), ": Error:", e)
+        return {"status": "error", "message": str(e)}
+
+
+@app.post("/cancel")  # Viene inviata dalla sessione quando viene pulita
+async def cancel(request: str):
+    """Annulla i frammenti ancora da sintetizzare di una richiesta."""
+    try:
+        removed = buffer.cancel(request)
+        await buffer.clear(request)
+        return {"status": "ok", "cancelled": removed}
+    except Exception as e:
+        print(color("[AUDIO BUFFER]", True, "red"), ": Error:", e)
+        return {"status": "error", "message": str(e)}
 
 
 @app.get("/")
-async def save_audio_file():
-    """Controlla se l'audio è completo e lo salva."""
+async def save_audio_file(request: str = ""):
+    """Controlla se l'audio della richiesta è completo e lo salva nello store."""
     try:
-        if await buffer.is_complete():
-            await buffer.save_audio("tmp.wav")
+        if await buffer.is_complete(request):
+            size = await buffer.save_audio(request)
             torch.cuda.empty_cache()
-            return {"status": "ok"}
+            return {
+                "status": "ok",
+                "url": f"/audio/{request}" if size else None,
+                "size": size,
+            }
         else:
             return {"status": "processing"}
     except Exception as e:
@@ -65,14 +115,60 @@ async def save_audio_file():
         return {"status": "error", "message": str(e)}
 
 
+@app.get("/audio/{request}")
+async def get_audio(request: str):
+    """Restituisce l'audio compresso di una richiesta completata."""
+    data = buffer.store.get(request) if buffer is not None else None
+    if data is None:
+        return Response(status_code=404)
+    bytes_transferred.inc(len(data), direction="served")
+    return Response(content=data, media_type=buffer.store.media_type)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Espone le metriche del buffer in formato Prometheus."""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
+
 @app.get("/start")
-def start():
-    global config, buffer, manager
+async def start():
+    async with start_lock:
+        return await _start()
+
+
+async def _start():
+    global config, buffer
     try:
+        if buffer is not None:
+            # il buffer è condiviso da tutte le sessioni: non va ricreato
+            return {"status": "ready", "colocated": config["colocated"]}
         config = load_config("./chat/tts/config.yaml")
-        manager = Manager(config["limit"])
-        buffer = AudioBuffer(manager, config["max_tokens"])
-        return {"status": "ready"}
+        await client_pool.aclose()
+        client_pool.configure(config["http"])
+        queue = JobQueue(
+            config["limit"], config["job_timeout"], config["job_retries"]
+        )
+        # In modalità co-located il maker gira in questo processo, senza HTTP;
+        # il modello si carica in un thread per non bloccare l'event loop
+        maker = None
+        if config["colocated"]:
+            maker = await asyncio.to_thread(AudioMaker, config)
+        store = AudioStore(
+            config["audio_store"]["format"],
+            config["audio_store"]["subtype"],
+            config["audio_store"]["max_mb"],
+        )
+        buffer = AudioBuffer(
+            queue,
+            config["max_tokens"],
+            config["maker_url"],
+            maker,
+            store,
+            config["session_ttl"],
+        )
+        buffer.start_workers()
+        return {"status": "ready", "colocated": config["colocated"]}
     except Exception as e:
         print(color("[AUDIO BUFFER]", True, "red"), ": Error:", e)
         return {"status": "error", "message": str(e)}
@@ -1,30 +1,79 @@
-import httpx
+from contextlib import asynccontextmanager
+from time import perf_counter
+
 import uvicorn
 from fastapi import BackgroundTasks, FastAPI
+from fastapi.responses import PlainTextResponse
 
 from chat.tts.audio_maker import AudioMaker
+from chat.tts.process_pool import ProcessPoolEngine
 from utilities.colorize import color
+from utilities.http_pool import client_pool
+from utilities.metrics import CONTENT_TYPE, metrics
 from utilities.utilities import load_config
 from utilities.tts_utilities import (AudioRequest, MultipleAudioRequest,
                            MultipleTextRequest)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    if maker is not None:
+        maker.close()
+    await client_pool.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 config = None
 maker = None
 
+serialize_time = metrics.histogram(
+    "tts_audio_serialize_seconds", "Time to serialize the audio sent to the buffer"
+)
+bytes_transferred = metrics.counter(
+    "tts_audio_bytes_total", "Request bytes sent to the buffer on /store_audio"
+)
+
 
 @app.get("/start")
 def start():
     global config, maker
     try:
+        if maker is not None:
+            # il modello è condiviso da tutte le sessioni: non va ricaricato
+            return {"status": "ready"}
         config = load_config("./chat/tts/config.yaml")
-        maker = AudioMaker(config)
+        client_pool.configure(config["http"])
+        engine = None
+        pool_config = config["process_pool"]
+        if pool_config["enabled"]:
+            engine = ProcessPoolEngine(
+                config,
+                pool_config["workers"],
+                pool_config["threads_per_worker"],
+                pool_config["pin_cores"],
+            )
+            engine.start()
+        maker = AudioMaker(config, engine)
         return {"status": "ready"}
     except Exception as e:
         print(color("[AUDIO MAKER]", True, "red"), ": Error during initialization:", e)
         return {"status": "error", "message": str(e)}
 
 
+@app.get("/cache")
+def cache_stats():
+    """Restituisce le statistiche della cache audio."""
+    if maker is None:
+        return {"status": "error", "message": "Audio maker not initialized"}
+    return {"status": "ok", "cache": maker.cache_stats()}
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Espone le metriche del maker in formato Prometheus."""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
+
 @app.post("/")
 async def generate(texts: MultipleTextRequest, background_tasks: BackgroundTasks):
     """Riceve una lista di testi e avvia la generazione di audio."""
@@ -39,32 +88,49 @@ async def generate(texts: MultipleTextRequest, background_tasks: BackgroundTasks
 
 async def process_and_notify(requests):
     """Elabora i testi e invia una notifica al mittente al termine."""
-    async with httpx.AsyncClient() as client:
-        try:
-            results = await maker.generate_audio(requests)
-            if results:
-                results = [
-                    AudioRequest(
-                        content=[str(chunk) for chunk in r.content],
-                        id=r.id,
-                        sub_id=r.sub_id,
-                    )
-                    for r in results
-                ]
-            audio_request = MultipleAudioRequest(requests=results)
-            # Inviare la POST al mittente
-            await client.post(
-                config["buffer_url"] + "store_audio", json=audio_request.model_dump()
-            )
-            print(
-                color("[AUDIO MAKER]", True, "cyan"),
-                ": Audio fragments sent to buffer",
-                sep="",
+    client = client_pool.get()
+    try:
+        results = await maker.generate_audio(requests)
+        start = perf_counter()
+        # Un frammento non generato viene segnalato, così il buffer lo ritenta
+        results = [
+            AudioRequest(
+                content=[str(chunk) for chunk in r.content],
+                id=r.id,
+                sub_id=r.sub_id,
+                request=r.request,
             )
-        except Exception as e:
-            error_data = {"status": "error", "message": str(e)}
-            await client.post(config["buffer_url"] + "store_audio", json=error_data)
-            print(color("[AUDIO MAKER]", True, "red"), ": Error:", e)
+            if r is not None
+            else failure(t, "Audio generation failed")
+            for t, r in zip(requests, results)
+        ]
+        audio_request = MultipleAudioRequest(requests=results)
+        serialize_time.observe(perf_counter() - start)
+        # Inviare la POST al mittente
+        response = await client.post(
+            config["buffer_url"] + "store_audio", json=audio_request.model_dump()
+        )
+        bytes_transferred.inc(len(response.request.content), direction="sent")
+        print(
+            color("[AUDIO MAKER]", True, "cyan"),
+            ": Audio fragments sent to buffer",
+            sep="",
+        )
+    except Exception as e:
+        print(color("[AUDIO MAKER]", True, "red"), ": Error:", e)
+        error_data = MultipleAudioRequest(
+            requests=[failure(t, str(e)) for t in requests]
+        )
+        await client.post(
+            config["buffer_url"] + "store_audio", json=error_data.model_dump()
+        )
+
+
+def failure(text, message: str) -> AudioRequest:
+    """Frammento senza audio che segnala al buffer una sintesi fallita."""
+    return AudioRequest(
+        id=text.id, sub_id=text.sub_id, request=text.request, error=message
+    )
 
 
 if __name__ == "__main__":
@@ -1,29 +1,60 @@
 from typing import Any, List
 
 from langchain.retrievers.document_compressors.base import BaseDocumentCompressor
-from langchain_cohere import CohereEmbeddings, CohereRerank
 from langchain_community.vectorstores import FAISS
 from langchain_core.callbacks import CallbackManagerForRetrieverRun
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.retrievers import BaseRetriever, RetrieverLike
+from langchain_core.vectorstores import VectorStore
 
+from utilities.chunks import render_chunk
 from utilities.colorize import color
+from utilities.providers import make_embedder, make_reranker
+from vectorstore.docstore import load_compact
+from vectorstore.sharding import ShardedFAISS, shard_dirs
+
+
+def chunk_key(doc: Document):
+    """Stable id of a chunk, the metadata id for databases built without it."""
+    return doc.metadata.get("chunk_id", doc.metadata.get("id"))
+
+
+def reading_order(doc: Document):
+    """Sort key that keeps the chunks of a source in their original order."""
+    return (
+        doc.metadata.get("source", ""),
+        doc.metadata.get("seq", doc.metadata.get("id", 0)),
+    )
 
 
 def remove_duplicates(docs: list[Document]) -> list[Document]:
     seen = set()
-    return [
-        d
-        for d in docs
-        if not (d.metadata.get("id") in seen or seen.add(d.metadata.get("id")))
-    ]
+    return [d for d in docs if not (chunk_key(d) in seen or seen.add(chunk_key(d)))]
+
+
+def load_index(path: str, embedder, docstore: str) -> FAISS:
+    vectorstore = None
+    if docstore == "compact":
+        vectorstore = load_compact(path, embedder)
+        if vectorstore is None:
+            print(
+                color("[Retriever]", True, "yellow"),
+                ": Compact docstore not found or not aligned, loading the pickle",
+                sep="",
+            )
+    if vectorstore is None:
+        vectorstore = FAISS.load_local(
+            path, embeddings=embedder, allow_dangerous_deserialization=True
+        )
+    return vectorstore
 
 
 class Retriever(BaseRetriever):
     compressor: BaseDocumentCompressor
     retriever: RetrieverLike
-    embedder: CohereEmbeddings
-    vectorstore: FAISS
+    embedder: Embeddings
+    vectorstore: VectorStore
     retrieval_threshold: float
     distance_threshold: float
     simplifier: float
@@ -145,7 +176,7 @@ class Retriever(BaseRetriever):
         if not refiltered_docs:
             return []
 
-        return sorted(refiltered_docs, key=lambda x: x.metadata.get("id"))
+        return sorted(refiltered_docs, key=reading_order)
 
     def filter_by_similarity(self, docs: list[Document], threshold=0) -> list[Document]:
         if threshold == 0:
@@ -158,7 +189,7 @@ class Retriever(BaseRetriever):
         return [d for (d, score) in docs if score < threshold]
 
     def search_by_vector(self, docs: List[Document]) -> list[Document]:
-        embedded_docs = self.embedder.embed_documents([d.page_content for d in docs])
+        embedded_docs = self.embedder.embed_documents([render_chunk(d) for d in docs])
         similar_docs = []
         for doc in embedded_docs:
             sim = self.vectorstore.similarity_search_with_score_by_vector(doc)
@@ -172,17 +203,33 @@ class Retriever(BaseRetriever):
 class RetrieverBuilder:
     @classmethod
     def build(self, config) -> Retriever:
+        embedder = make_embedder(config)
+        docstore = config.get("docstore", "pickle")
+        shards = shard_dirs(config["db"])
+        if shards:
+            vectorstore = ShardedFAISS(
+                [load_index(path, embedder, docstore) for path in shards], embedder
+            )
+            print(
+                color("[Retriever]", True, "blue"),
+                f": Loaded {len(shards)} index shards",
+                sep="",
+            )
+        else:
+            vectorstore = load_index(config["db"], embedder, docstore)
+        return self.from_vectorstore(config, vectorstore, embedder)
+
+    @classmethod
+    def from_vectorstore(
+        self, config, vectorstore: VectorStore, embedder: Embeddings
+    ) -> Retriever:
         retrieval_threshold = config["retrieval_threshold"]
         distance_threshold = config["distance_threshold"]
         simplifier = config["simplifier"]
-        embedder = CohereEmbeddings(model=config["embedder"])
-        vectorstore = FAISS.load_local(
-            config["db"], embeddings=embedder, allow_dangerous_deserialization=True
-        )
         retriever = vectorstore.as_retriever(
             search_type="similarity", search_kwargs={"k": config["k"]}
         )
-        compressor = CohereRerank(model=config["reranker"], top_n=config["top_n"])
+        compressor = make_reranker(config)
         print(color("[Retriever]", True, "blue"), ": Retriever initialized", sep="")
 
         return Retriever(
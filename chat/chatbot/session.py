@@ -2,14 +2,21 @@ import os
 
 import httpx
 import sounddevice as sd
-import soundfile as sf
 import streamlit as st
-from langchain_ollama import ChatOllama
 
 from chat.chatbot.graph import App, Graph, Router
 from chat.chatbot.retriever import RetrieverBuilder
+from chat.tts.pipeline import EmbeddedPipeline
 from utilities.utilities import ChatHistory, StdOutHandler, load_config
 from utilities.colorize import color
+from utilities.http_pool import client_pool
+from utilities.providers import make_chat_model
+
+
+@st.cache_resource
+def get_pipeline(tts_config: str) -> EmbeddedPipeline:
+    """Pipeline TTS condivisa da tutte le sessioni del processo."""
+    return EmbeddedPipeline(load_config(tts_config))
 
 
 class Session:
@@ -25,6 +32,7 @@ class Session:
         if "is_initialized" not in self.state or not self.state.is_initialized:
             self.state.is_initialized = False
             self.state.config = load_config("./chat/chatbot/config.yaml")
+            client_pool.configure(self.state.config["http"])
             print(color("[Session]", True, "green"), ": Config loaded", sep="")
 
             # Messaggi
@@ -36,8 +44,12 @@ class Session:
             print(color("[Session]", True, "green"), ": History initialized", sep="")
 
             # Handler
+            embedded = self.state.config["tts_mode"] == "embedded"
+            pipeline = None
+            if embedded:
+                pipeline = get_pipeline(self.state.config["tts_config"])
             self.state.handler = StdOutHandler(
-                self.state.config, audio=True, debug=False
+                self.state.config, audio=True, debug=False, pipeline=pipeline
             )
             print(color("[Session]", True, "green"), ": Handler initialized", sep="")
 
@@ -53,10 +65,7 @@ class Session:
             print(color("[Session]", True, "green"), ": Retriever initialized", sep="")
 
             # LLMs
-            self.state.llm = ChatOllama(
-                model=self.state.config["model"]["name"],
-                temperature=self.state.config["model"]["temperature"],
-            )
+            self.state.llm = make_chat_model(self.state.config)
             print(color("[Session]", True, "green"), ": LLM initialized", sep="")
 
             # Router
@@ -91,31 +100,40 @@ class Session:
             print(color("[Session]", True, "green"), ": Graph initialized", sep="")
 
             # Syncronize with the server
-            response = httpx.get("http://localhost:8000/start", timeout=20)
-            if response.json().get("status", "error") == "error":
-                error = response.json().get("message", "Error")
-                self.state.handler.set_audio(False)
-                print(error)
-                raise Exception(error)
-            elif response.json().get("status", "error") == "ready":
-                print(
-                    color("[Session]", True, "green"),
-                    ": AudioBuffer initialized",
-                    sep="",
+            if not embedded:
+                response = httpx.get(
+                    "http://localhost:8000/start",
+                    timeout=self.state.config["http"]["start_timeout"],
                 )
+                if response.json().get("status", "error") == "error":
+                    error = response.json().get("message", "Error")
+                    self.state.handler.set_audio(False)
+                    print(error)
+                    raise Exception(error)
+                elif response.json().get("status", "error") == "ready":
+                    print(
+                        color("[Session]", True, "green"),
+                        ": AudioBuffer initialized",
+                        sep="",
+                    )
+                colocated = response.json().get("colocated", False)
 
-            response = httpx.get("http://localhost:9000/start", timeout=20)
-            if response.json().get("status", "error") == "error":
-                error = response.json().get("message", "Error")
-                self.state.handler.set_audio(False)
-                print(error)
-                raise Exception(error)
-            elif response.json().get("status", "error") == "ready":
-                print(
-                    color("[Session]", True, "green"),
-                    ": AudioMaker initialized",
-                    sep="",
-                )
+                if not colocated:
+                    response = httpx.get(
+                        "http://localhost:9000/start",
+                        timeout=self.state.config["http"]["start_timeout"],
+                    )
+                    if response.json().get("status", "error") == "error":
+                        error = response.json().get("message", "Error")
+                        self.state.handler.set_audio(False)
+                        print(error)
+                        raise Exception(error)
+                    elif response.json().get("status", "error") == "ready":
+                        print(
+                            color("[Session]", True, "green"),
+                            ": AudioMaker initialized",
+                            sep="",
+                        )
   
             self.state.is_generating = False
 
@@ -182,6 +200,7 @@ class Session:
             if st.button("Clear", use_container_width=True, disabled=self.state.is_generating):
                 self.state.messages = []
                 self.state.history.clear()
+                await self.state.handler.cancel()
                 self.state.graph = Graph(
                     self.state.llm,
                     self.state.router,
@@ -203,13 +222,14 @@ class Session:
 
         # AUDIO
         if len(self.state.messages) >= 2:
-            if os.path.exists("tmp.wav"):
+            if self.state.handler.audio_request is not None:
                 cols = st.columns(10)
                 with cols[0]:
                     if st.button("🔈", disabled=self.state.is_generating):
-                        data, fs = sf.read("tmp.wav", dtype="float32")
-                        sd.play(data, fs)
-                        sd.wait()
+                        clip = await self.state.handler.get_audio()
+                        if clip is not None:
+                            sd.play(*clip)
+                            sd.wait()
                 with cols[1]:
                     if st.button("🔇", disabled=self.state.is_generating):
                         sd.stop()
@@ -1,157 +1,316 @@
 import asyncio
+from time import time
 
-import httpx
 import numpy as np
 import pyrubberband as pyrb
-import soundfile as sf
-import tiktoken
 
+from chat.tts.audio_store import AudioStore
+from chat.tts.chunker import TextChunker
+from chat.tts.job_queue import Job, JobQueue
 from utilities.colorize import color
+from utilities.http_pool import client_pool
+from utilities.metrics import metrics
 from utilities.tts_utilities import (AudioFragment, MultipleTextRequest,
                                      TextFragment, TextRequest)
 
 
-class Manager:
-    def __init__(self, n_max_threads):
-        self.n_threads = 0
-        self.n_max_threads = n_max_threads
+class AudioSession:
+    """Stato audio di una singola richiesta."""
 
-    def is_busy(self):
-        return self.n_threads >= self.n_max_threads
+    def __init__(self, request: str):
+        self.request = request
+        self.fragments: list[AudioFragment] = []
+        self.created = time()
+        self.first_audio = None  # istante del primo frammento audio ricevuto
+        self.last_activity = time()
 
-    def add_threads(self, n):
-        if not self.is_busy() and self.n_threads + n <= self.n_max_threads:
-            self.n_threads += n
-            print("Active threads:", self.n_threads)
-            print("Free threads:", self.get_free_threads())
-            return True
-        return False
-
-    def remove_threads(self, n):
-        if self.n_threads - n >= 0:
-            self.n_threads -= n
-            print("Active threads:", self.n_threads)
-            print("Free threads:", self.get_free_threads())
-            return True
-        return False
-
-    def get_free_threads(self) -> int:
-        return self.n_max_threads - self.n_threads
-
-    def is_working(self) -> bool:
-        return self.n_threads > 0
+    def touch(self):
+        self.last_activity = time()
 
 
 class AudioBuffer:
-    """Gestisce il buffering di testi e frammenti audio."""
+    """Gestisce il buffering di testi e frammenti audio, separato per richiesta."""
 
-    def __init__(self, manager: Manager, max_tokens=200):
-        self.text_fragments = []  # lista dei testi in arrivo
-        self.audio_fragments = []  # lista dei frammenti audio
+    def __init__(
+        self,
+        queue: JobQueue,
+        max_tokens=200,
+        maker_url="http://localhost:9000/",
+        maker=None,
+        store: AudioStore | None = None,
+        session_ttl=600,
+    ):
+        self.sessions: dict[str, AudioSession] = {}
+        self.pending = {}  # job in attesa dell'audio dal maker
+        self.workers = []
         self.lock = asyncio.Lock()
-        self.manager = manager
+        self.queue = queue
         self.max_tokens = max_tokens
+        self.chunker = TextChunker(max_tokens)
+        self.maker_url = maker_url
+        self.maker = maker  # AudioMaker nello stesso processo (modalità co-located)
+        self.store = store or AudioStore()  # audio completo delle richieste, compresso
+        self.session_ttl = session_ttl
+        self._init_metrics()
         print(
             color("[AUDIO BUFFER]", True, "magenta"),
             ": Audio buffer initialized",
             sep="",
         )
 
+    def _init_metrics(self):
+        metrics.gauge(
+            "tts_queue_depth",
+            "Fragments waiting to be synthesized",
+            lambda: len(self.queue),
+        )
+        metrics.gauge(
+            "tts_in_flight_fragments",
+            "Fragments sent to the TTS and not yet completed",
+            lambda: len(self.queue.in_flight),
+        )
+        metrics.gauge("tts_sessions", "Active audio sessions", lambda: len(self.sessions))
+        metrics.gauge(
+            "tts_audio_store_bytes",
+            "Compressed audio kept in memory",
+            lambda: self.store.bytes,
+        )
+        self.fragment_latency = metrics.histogram(
+            "tts_fragment_seconds", "Time from dequeue to audio for a fragment"
+        )
+        self.first_audio_latency = metrics.histogram(
+            "tts_time_to_first_audio_seconds",
+            "Time from the first text of a request to its first audio fragment",
+        )
+        self.fragments_total = metrics.counter(
+            "tts_fragments_total", "Fragments processed by the buffer workers"
+        )
+        self.encode_time = metrics.histogram(
+            "tts_audio_encode_seconds", "Time to stretch and compress a finished request"
+        )
+
+    def start_workers(self):
+        """Avvia il pool di worker che inviano i job al TTS."""
+        self.workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.queue.n_workers)
+        ]
+
+    async def stop_workers(self):
+        """Ferma i worker e scarta i job in sospeso."""
+        self.cancel()
+        for w in self.workers:
+            w.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def _session(self, request: str) -> AudioSession:
+        session = self.sessions.get(request)
+        if session is None:
+            session = self.sessions[request] = AudioSession(request)
+        session.touch()
+        return session
+
     async def add_text(self, text: TextFragment):
-        """Aggiunge un testo al buffer."""
+        """Aggiunge un testo alla coda di sintesi."""
+        await self.expire()
         async with self.lock:
-            self.text_fragments.append(text)
+            self._session(text.request)
+        await self.queue.put(text)
 
     async def add_audio(self, audio: AudioFragment):
-        """Aggiunge un frammento audio al buffer."""
+        """Aggiunge un frammento audio al buffer, se il job corrispondente è ancora attivo."""
+        key = (audio.request, audio.id, audio.sub_id or 0)
+        future = self.pending.pop(key, None)
+        if future is None or future.done():
+            return
         async with self.lock:
-            self.audio_fragments.append(audio)
+            session = self.sessions.get(audio.request)
+            if session is not None:
+                session.fragments.append(audio)
+                session.touch()
+                if session.first_audio is None:
+                    session.first_audio = session.last_activity
+                    self.first_audio_latency.observe(
+                        session.first_audio - session.created
+                    )
+        future.set_result(audio)
+
+    def fail_audio(self, request: str, id: int, sub_id: int | None, message: str):
+        """Segnala la sintesi fallita di un frammento, che il worker ritenta."""
+        future = self.pending.pop((request, id, sub_id or 0), None)
+        if future is not None and not future.done():
+            future.set_exception(Exception(f"Errore del TTS: {message}"))
 
-    async def _get_audio(self) -> np.ndarray | None:
-        """Restituisce l'audio completo concatenando i frammenti."""
+    async def _get_fragments(self, request: str) -> list[np.ndarray]:
+        """Restituisce i frammenti audio di una richiesta, in ordine."""
         async with self.lock:
+            session = self.sessions.get(request)
+            if session is None:
+                return []
             sorted_fragments = sorted(
-                self.audio_fragments, key=lambda x: (x.id, x.sub_id)
+                session.fragments, key=lambda x: (x.id, x.sub_id)
             )
-            if sorted_fragments:
-                audio = np.concatenate([fragment.content for fragment in sorted_fragments])
-                return audio
-            return None
+            return [fragment.content for fragment in sorted_fragments]
 
-    async def save_audio(self, path: str):
-        """Salva l'audio completo su file."""
-        audio = await self._get_audio()
+    def _encode(self, request: str, fragments: list[np.ndarray]) -> int:
+        """Concatena, accelera e comprime l'audio nello store (fuori dall'event loop)."""
+        audio = np.concatenate(fragments)
         stretched = pyrb.time_stretch(audio, 22050, 1.1)
-        sf.write(path, stretched, 22050, format="wav")
-        await self.clear()
+        return self.store.put(request, stretched, 22050)
+
+    async def save_audio(self, request: str) -> int | None:
+        """Comprime l'audio di una richiesta nello store e ne restituisce i byte."""
+        fragments = await self._get_fragments(request)
+        if not fragments:
+            if request in self.store:
+                return len(self.store.get(request))
+            print(color("[AUDIO BUFFER]", True, "yellow"), ": No audio to save", sep="")
+            return None
+        with self.encode_time.time():
+            size = await asyncio.to_thread(self._encode, request, fragments)
+        async with self.lock:
+            session = self._session(request)
+            session.fragments = []
         print(
-            color("[AUDIO BUFFER]", True, "magenta"), ": Audio saved to ", path, sep=""
+            color("[AUDIO BUFFER]", True, "magenta"),
+            f": Audio stored for {request} ({size / 1024:.1f} KB)",
+            sep="",
         )
+        return size
 
-    async def is_complete(self):
-        """Verifica se il maker ha finito di generare tutti i frammenti audio."""
+    async def is_complete(self, request: str):
+        """Verifica se il maker ha finito di generare tutti i frammenti audio della richiesta."""
         async with self.lock:
-            return len(self.text_fragments) == 0 and not self.manager.is_working()
+            return self.queue.is_idle(request)
 
-    async def clear(self):
-        """Resetta il buffer."""
+    async def clear(self, request: str | None = None):
+        """Resetta i frammenti e l'audio salvato di una richiesta (o di tutte)."""
         async with self.lock:
-            self.text_fragments = []
-            self.audio_fragments = []
+            if request is None:
+                sessions = list(self.sessions.values())
+            else:
+                sessions = [self.sessions[request]] if request in self.sessions else []
+            for session in sessions:
+                session.fragments = []
+                self.store.remove(session.request)
+
+    def cancel(self, request: str | None = None) -> int:
+        """Annulla i job di una richiesta (o di tutte) ancora da sintetizzare."""
+        removed = self.queue.cancel(request)
+        for key, future in list(self.pending.items()):
+            if self.queue.is_cancelled(key) and not future.done():
+                future.set_result(None)
+                del self.pending[key]
+        print(
+            color("[AUDIO BUFFER]", True, "magenta"),
+            f": Cancelled {removed} pending fragments",
+            sep="",
+        )
+        return removed
 
-    async def send(self):
-        """Invia fino a self.limit TextRequest al TTS per la generazione dell'audio."""
+    async def expire(self):
+        """Rimuove le sessioni inattive da più di session_ttl secondi."""
+        now = time()
         async with self.lock:
-            if not self.manager.is_busy():
-                try:
-                    items = [
-                        self.text_fragments.pop(0)
-                        for _ in range(
-                            min(
-                                self.manager.get_free_threads(),
-                                len(self.text_fragments),
-                            )
-                        )
-                    ]
-                    if items:
-                        requests = [TextRequest(text=r.text, id=r.id) for r in items]
-                    else:
-                        return
-                    data = MultipleTextRequest(requests=requests)
-                    async with httpx.AsyncClient() as client:
-                        response = await client.post(
-                            "http://localhost:9000/", json=data.model_dump()
-                        )
-                        self.manager.add_threads(len(requests))
-                        if response.json().get("status", "error") == "error":
-                            raise Exception(
-                                f"Errore {response.status_code} durante la richiesta al TTS"
-                            )
-                        print(
-                            color("[AUDIO BUFFER]", True, "magenta"),
-                            ": Request sent to TTS (",
-                            len(requests),
-                            " fragments)",
-                            sep="",
-                        )
-                except Exception as e:
-                    print(color("[AUDIO BUFFER]", True, "red"), ": Error:", e)
-            else:
+            expired = [
+                s for s in self.sessions.values()
+                if now - s.last_activity > self.session_ttl
+            ]
+            for session in expired:
+                del self.sessions[session.request]
+        for session in expired:
+            self.cancel(session.request)
+            self.queue.forget(session.request)
+            self.store.remove(session.request)
+        if expired:
+            print(
+                color("[AUDIO BUFFER]", True, "magenta"),
+                f": Expired {len(expired)} idle sessions",
+                sep="",
+            )
+
+    async def _worker(self):
+        """
+        Estrae i job dalla coda e li invia al TTS uno alla volta. I job falliti
+        vengono ritentati, quelli scaduti per timeout no.
+        """
+        while True:
+            job = await self.queue.get()
+            start = time()
+            try:
+                await asyncio.wait_for(self.send(job), self.queue.timeout)
+                self.queue.done(job)
+                self.fragment_latency.observe(time() - start)
+                self.fragments_total.inc(status="ok")
+            except asyncio.CancelledError:
+                self.queue.done(job)
+                raise
+            except asyncio.TimeoutError:
+                # Il maker potrebbe ancora sintetizzare il frammento: rimetterlo
+                # in coda lo farebbe sintetizzare due volte, quindi si scarta
+                self.pending.pop(job.key, None)
+                self.queue.done(job)
+                self.fragments_total.inc(status="timeout")
                 print(
-                    color("[AUDIO BUFFER]", True, "magenta"),
-                    ": TTS is busy, waiting for free threads",
+                    color("[AUDIO BUFFER]", True, "red"),
+                    f": Dropping {job}: no audio after {self.queue.timeout}s",
                     sep="",
                 )
+            except Exception as e:
+                self.pending.pop(job.key, None)
+                if await self.queue.retry(job):
+                    self.fragments_total.inc(status="retried")
+                    print(
+                        color("[AUDIO BUFFER]", True, "yellow"),
+                        f": Retrying {job} after error: {e!r}",
+                        sep="",
+                    )
+                else:
+                    self.fragments_total.inc(status="dropped")
+                    print(
+                        color("[AUDIO BUFFER]", True, "red"),
+                        f": Dropping {job} after error: {e!r}",
+                        sep="",
+                    )
 
-    def split_text_into_chunks(self, text, encoding="cl100k_base"):
-        """Divide il testo in segmenti rispettando il limite massimo di token."""
-        tokenizer = tiktoken.get_encoding(encoding)
-        tokens = tokenizer.encode(text)
+    async def send(self, job: Job):
+        """Invia un job al TTS e attende il frammento audio corrispondente."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending[job.key] = future
+        fragment = job.fragment
+        request = TextRequest(
+            text=fragment.text,
+            id=fragment.id,
+            sub_id=fragment.sub_id,
+            request=fragment.request,
+        )
+        if self.maker is not None:
+            results = await self.maker.generate_audio([request])
+            for r in results:
+                if r is not None:
+                    await self.add_audio(r)
+        else:
+            data = MultipleTextRequest(requests=[request])
+            response = await client_pool.get().post(
+                self.maker_url, json=data.model_dump()
+            )
+            if response.json().get("status", "error") == "error":
+                raise Exception(
+                    f"Errore {response.status_code} durante la richiesta al TTS"
+                )
+            print(
+                color("[AUDIO BUFFER]", True, "magenta"),
+                f": Request sent to TTS ({job})",
+                sep="",
+            )
+        if self.maker is not None and not future.done():
+            self.pending.pop(job.key, None)
+            raise Exception("Nessun audio generato dal maker locale")
+        return await future
 
-        chunks = []
-        for i in range(0, len(tokens), self.max_tokens):
-            chunk_tokens = tokens[i: i + self.max_tokens]
-            chunks.append(tokenizer.decode(chunk_tokens))
+    def split_text_into_chunks(self, text):
+        """Divide il testo in segmenti bilanciati entro il limite massimo di token."""
+        chunks = self.chunker.split(text)
         if len(chunks) > 1:
             print(
                 color("[AUDIO BUFFER]", True, "magenta"),
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+from utilities.colorize import color
+
+
+class AudioCache:
+    """
+    Cache content-addressed dei frammenti audio già sintetizzati.
+
+    I frammenti sono indicizzati per (testo normalizzato, speaker, lingua, velocità,
+    modello). In memoria è tenuta una LRU di array float32, su disco i file .npy
+    in PCM a 16 bit. Entrambi i livelli sono limitati in dimensione ed eliminano
+    per primi i frammenti usati meno di recente.
+    """
+
+    def __init__(self, directory: str, memory_mb: float = 64, disk_mb: float = 512):
+        self.directory = directory
+        self.max_memory_bytes = int(memory_mb * 1024 * 1024)
+        self.max_disk_bytes = int(disk_mb * 1024 * 1024)
+        self.memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.memory_bytes = 0
+        self.disk: OrderedDict[str, int] = OrderedDict()
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan_disk()
+        print(
+            color("[AUDIO CACHE]", True, "cyan"),
+            f": Audio cache initialized ({len(self.disk)} fragments on disk)",
+            sep="",
+        )
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r"\s+", " ", text).strip().lower()
+
+    def key(self, text: str, speaker: str, language: str, speed: float, model: str) -> str:
+        """Calcola la chiave del frammento."""
+        raw = "\x1f".join((self.normalize(text), speaker, language, f"{speed:g}", model))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> np.ndarray | None:
+        """Restituisce l'audio associato alla chiave, se presente."""
+        audio = self.memory.get(key)
+        if audio is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return audio
+        if key in self.disk:
+            try:
+                pcm = np.load(self._path(key))
+                audio = pcm.astype(np.float32) / 32767
+                os.utime(self._path(key))
+                self.disk.move_to_end(key)
+                self._put_memory(key, audio)
+                self.hits += 1
+                self.disk_hits += 1
+                return audio
+            except (OSError, ValueError):
+                self._remove_disk(key)
+        self.misses += 1
+        return None
+
+    def put(self, key: str, audio) -> None:
+        """Salva un frammento in memoria e su disco."""
+        audio = np.asarray(audio, dtype=np.float32)
+        self._put_memory(key, audio)
+        if key in self.disk:
+            return
+        pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+        path = self._path(key)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, pcm)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        self.disk[key] = size
+        self.disk_bytes += size
+        while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+            self._remove_disk(next(iter(self.disk)))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory_bytes,
+            "disk_entries": len(self.disk),
+            "disk_bytes": self.disk_bytes,
+        }
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".npy")
+
+    def _put_memory(self, key: str, audio: np.ndarray):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        self.memory[key] = audio
+        self.memory_bytes += audio.nbytes
+        while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+
+    def _remove_disk(self, key: str):
+        self.disk_bytes -= self.disk.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _scan_disk(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".npy"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[: -len(".npy")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_bytes += size
@@ -1,21 +1,103 @@
 import asyncio
+from time import perf_counter
 
+import numpy as np
 import torch
 from TTS.api import TTS
 
+from chat.tts.audio_cache import AudioCache
+from chat.tts.batching import BatchScheduler, XttsBatchSynthesizer
+from chat.tts.cpu_optimizer import optimize_for_cpu
+from chat.tts.speaker_cache import SpeakerCache
 from utilities.colorize import color
+from utilities.metrics import RTF_BUCKETS, metrics
 from utilities.tts_utilities import AudioFragment, TextRequest
 
 
+SAMPLE_RATE = 24000  # frequenza di uscita di XTTS
+
+
 class AudioMaker:
     """Gestisce la generazione di audio con TTS."""
 
-    def __init__(self, config):
+    def __init__(self, config, engine=None):
         self.config = config
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.tts = TTS(model_name=self.config["tts_model"]).to(device)
+        self.engine = engine  # ProcessPoolEngine: il modello gira nei processi worker
+        self.speaker = self.config["speakers"][self.config["speaker_index"]]
+        self.language = self.config.get("language", "it")
+        self.speed = self.config.get("speed", 2.0)
+        cache_config = self.config.get("cache", {})
+        self.cache = None
+        if cache_config.get("enabled", False):
+            self.cache = AudioCache(
+                cache_config["dir"], cache_config["memory_mb"], cache_config["disk_mb"]
+            )
+        self.tts = None
+        self.synthesizer = None
+        self.batcher = None
+        self.sample_rate = SAMPLE_RATE
+        if self.engine is None:
+            self._load_model()
+            self.sample_rate = self.tts.synthesizer.output_sample_rate
+        self.active = 0
+        self._init_metrics()
         print(color("[AUDIO MAKER]", True, "cyan"), ": Audio maker initialized", sep="")
 
+    def _load_model(self):
+        device = self.config.get("device") or (
+            "cuda" if torch.cuda.is_available() else "cpu"
+        )
+        self.tts = TTS(model_name=self.config["tts_model"]).to(device)
+        self.speaker_cache = None
+        speaker_cache_config = self.config.get("speaker_cache", {})
+        if speaker_cache_config.get("enabled", False):
+            self.speaker_cache = SpeakerCache(
+                self.tts.synthesizer.tts_model,
+                self.config["tts_model"],
+                speaker_cache_config.get("dir"),
+            )
+            self.speaker_cache.load(self.config["speakers"])
+        cpu_config = self.config.get("cpu_mode", {})
+        if cpu_config.get("enabled", False) and device == "cpu":
+            optimize_for_cpu(self.tts.synthesizer.tts_model, cpu_config)
+        batching_config = self.config.get("batching", {})
+        self.synthesizer = XttsBatchSynthesizer(
+            self.tts,
+            self.speaker,
+            self.language,
+            self.speed,
+            self.speaker_cache,
+            batching_config.get("max_batch", 1),
+        )
+        if batching_config.get("enabled", False):
+            self.batcher = BatchScheduler(
+                self.synthesizer.synthesize, batching_config["max_wait_ms"] / 1000
+            )
+
+    def _init_metrics(self):
+        metrics.gauge(
+            "tts_maker_in_flight_fragments",
+            "Fragments being synthesized by the maker",
+            lambda: self.active,
+        )
+        self.synthesis_time = metrics.histogram(
+            "tts_synthesis_seconds", "Synthesis time of a fragment, cache misses only"
+        )
+        self.rtf = metrics.histogram(
+            "tts_real_time_factor",
+            "Synthesis time divided by audio duration of a fragment",
+            RTF_BUCKETS,
+        )
+        self.cache_lookups = metrics.counter(
+            "tts_cache_lookups_total", "Audio cache lookups by result"
+        )
+        if self.cache:
+            metrics.gauge(
+                "tts_cache_bytes",
+                "Audio cache size in memory",
+                lambda: self.cache.memory_bytes,
+            )
+
     async def generate_audio(self, texts: list[TextRequest]):
         """Genera frammenti audio gestendo memoria GPU in modo efficiente."""
         tasks = []
@@ -25,16 +107,53 @@ class AudioMaker:
 
         return await asyncio.gather(*tasks)
 
+    def cache_stats(self) -> dict:
+        return self.cache.stats() if self.cache else {}
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.stop()
+
     async def _generate_fragment(self, t: TextRequest):
         """Genera un singolo frammento audio."""
         print(color("Chunk length:", True, "cyan"), len(t.text))
+        self.active += 1
         try:
-            speaker = self.config["speakers"][self.config["speaker_index"]]
-            with torch.no_grad():
+            key = None
+            if self.cache:
+                key = self.cache.key(
+                    t.text, self.speaker, self.language, self.speed, self.config["tts_model"]
+                )
+                cached = self.cache.get(key)
+                self.cache_lookups.inc(result="miss" if cached is None else "hit")
+                if cached is not None:
+                    print(
+                        color("[AUDIO MAKER]", True, "cyan"),
+                        f": Cache hit for ID {t.id}{('-' + str(t.sub_id)) if t.sub_id else ''}",
+                        sep="",
+                    )
+                    return AudioFragment(
+                        content=cached, id=t.id, sub_id=t.sub_id, request=t.request
+                    )
+            start = perf_counter()
+            if self.engine:
+                fragment = await self.engine.submit(t.text)
+            elif self.batcher:
+                fragment = await self.batcher.submit(t.text)
+            else:
                 fragment = await asyncio.to_thread(
-                    self.tts.tts, text=t.text, language="it", speaker=speaker, speed=2.0
+                    self.synthesizer.synthesize_one, t.text
                 )
-            audio_fragment = AudioFragment(content=fragment, id=t.id, sub_id=t.sub_id)
+            fragment = np.asarray(fragment, dtype=np.float32)
+            elapsed = perf_counter() - start
+            self.synthesis_time.observe(elapsed)
+            if len(fragment):
+                self.rtf.observe(elapsed / (len(fragment) / self.sample_rate))
+            if self.cache:
+                self.cache.put(key, fragment)
+            audio_fragment = AudioFragment(
+                content=fragment, id=t.id, sub_id=t.sub_id, request=t.request
+            )
             print(
                 color("[AUDIO MAKER]", True, "cyan"),
                 f": Audio fragment generated for ID {t.id}{('-' + str(t.sub_id)) if t.sub_id else ''}",
@@ -47,4 +166,6 @@ class AudioMaker:
                 ": Error during audio generation:",
                 e,
             )
-            torch.cuda.empty_cache()
\ No newline at end of file
+            torch.cuda.empty_cache()
+        finally:
+            self.active -= 1
@@ -0,0 +1,75 @@
+import io
+from collections import OrderedDict
+
+import numpy as np
+import soundfile as sf
+
+from utilities.colorize import color
+
+MEDIA_TYPES = {"OGG": "audio/ogg", "FLAC": "audio/flac", "WAV": "audio/wav"}
+
+
+class AudioStore:
+    """
+    Archivio in memoria dell'audio completo delle richieste.
+
+    Ogni clip è codificata una sola volta in un formato compresso (OGG Vorbis/Opus
+    o FLAC) e tenuta in memoria finché la sessione non scade, così la UI può
+    scaricarla per id di richiesta senza file temporanei su disco. La dimensione
+    totale è limitata: oltre il limite vengono eliminate le clip meno recenti.
+    """
+
+    def __init__(
+        self, audio_format: str = "OGG", subtype: str | None = "VORBIS", max_mb: float = 64
+    ):
+        self.format = audio_format.upper()
+        self.subtype = subtype
+        self.media_type = MEDIA_TYPES.get(self.format, "application/octet-stream")
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.clips: OrderedDict[str, bytes] = OrderedDict()
+        self.bytes = 0
+        print(
+            color("[AUDIO STORE]", True, "cyan"),
+            f": Audio store initialized ({self.format}/{self.subtype or 'default'})",
+            sep="",
+        )
+
+    def encode(self, audio: np.ndarray, sample_rate: int) -> bytes:
+        """Codifica un array float32 nel formato dell'archivio."""
+        data = io.BytesIO()
+        sf.write(data, audio, sample_rate, format=self.format, subtype=self.subtype)
+        return data.getvalue()
+
+    @staticmethod
+    def decode(data: bytes) -> tuple[np.ndarray, int]:
+        """Decodifica una clip in (array float32, frequenza di campionamento)."""
+        return sf.read(io.BytesIO(data), dtype="float32")
+
+    def put(self, request: str, audio: np.ndarray, sample_rate: int) -> int:
+        """Codifica e salva l'audio di una richiesta, restituendo la dimensione in byte."""
+        data = self.encode(audio, sample_rate)
+        self.remove(request)
+        self.clips[request] = data
+        self.bytes += len(data)
+        while self.bytes > self.max_bytes and len(self.clips) > 1:
+            _, evicted = self.clips.popitem(last=False)
+            self.bytes -= len(evicted)
+        return len(data)
+
+    def get(self, request: str) -> bytes | None:
+        """Restituisce la clip codificata di una richiesta, se presente."""
+        data = self.clips.get(request)
+        if data is not None:
+            self.clips.move_to_end(request)
+        return data
+
+    def remove(self, request: str):
+        data = self.clips.pop(request, None)
+        if data is not None:
+            self.bytes -= len(data)
+
+    def __contains__(self, request: str) -> bool:
+        return request in self.clips
+
+    def __len__(self):
+        return len(self.clips)
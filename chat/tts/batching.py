@@ -0,0 +1,201 @@
+import asyncio
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from utilities.colorize import color
+
+SENTENCE_PAUSE = 10000  # campioni di silenzio aggiunti da TTS.api dopo ogni frase
+
+
+class XttsBatchSynthesizer:
+    """
+    Sintesi di più frammenti in un unico forward pass del modello XTTS.
+
+    Nello stesso batch finiscono solo testi con lo stesso numero di token: il
+    GPT di XTTS non riceve una attention mask né in generazione né nel calcolo
+    dei latenti, quindi un testo allungato con del padding verrebbe sintetizzato
+    in modo diverso. I codici audio del batch vengono poi separati e decodificati
+    singolarmente dalla HiFi-GAN (il padding dei codici segue lo stop ed è
+    ignorato, essendo il modello causale). Se il modello non è XTTS, o il batch
+    fallisce, si torna alla sintesi di un frammento alla volta.
+    """
+
+    def __init__(self, tts, speaker, language, speed, speaker_cache=None, max_batch=4):
+        self.tts = tts
+        self.model = tts.synthesizer.tts_model
+        self.speaker = speaker
+        self.speaker_cache = speaker_cache
+        self.language = language
+        self.speed = speed
+        self.max_batch = max_batch
+        self.supported = hasattr(self.model, "gpt") and hasattr(self.model, "hifigan_decoder")
+
+    def conditioning(self):
+        """Restituisce (gpt_cond_latent, speaker_embedding) dello speaker configurato."""
+        if self.speaker_cache is not None:
+            return self.speaker_cache.get(self.speaker)
+        latents = self.model.speaker_manager.speakers[self.speaker]
+        device = self.model.device
+        return latents["gpt_cond_latent"].to(device), latents["speaker_embedding"].to(device)
+
+    def synthesize(self, texts: list[str]) -> list[np.ndarray]:
+        """Sintetizza i testi e restituisce un array per testo, nello stesso ordine."""
+        if not self.supported:
+            return [self.synthesize_one(t) for t in texts]
+        tokens = [self._encode(t) for t in texts]
+        results = [None] * len(texts)
+        for group in self.group([len(t) for t in tokens]):
+            if len(group) == 1:
+                results[group[0]] = self.synthesize_one(texts[group[0]])
+                continue
+            try:
+                wavs = self._synthesize_batch([tokens[i] for i in group])
+            except Exception as e:
+                print(
+                    color("[AUDIO MAKER]", True, "yellow"),
+                    f": Batch of {len(group)} failed, falling back to single inference: {e}",
+                    sep="",
+                )
+                wavs = [self.synthesize_one(texts[i]) for i in group]
+            for i, wav in zip(group, wavs):
+                results[i] = wav
+        return results
+
+    def group(self, lengths: list[int]) -> list[list[int]]:
+        """Raggruppa gli indici in batch di testi con lo stesso numero di token."""
+        buckets = {}
+        for i, length in enumerate(lengths):
+            buckets.setdefault(length, []).append(i)
+        return [
+            bucket[start : start + self.max_batch]
+            for bucket in buckets.values()
+            for start in range(0, len(bucket), self.max_batch)
+        ]
+
+    def _encode(self, text: str) -> list[int]:
+        language = self.language.split("-")[0]
+        return self.model.tokenizer.encode(text.strip().lower(), lang=language)
+
+    @torch.inference_mode()
+    def synthesize_one(self, text: str) -> np.ndarray:
+        """Sintetizza un singolo testo, usando i latenti in cache se disponibili."""
+        if not self.supported or self.speaker_cache is None:
+            wav = self.tts.tts(
+                text=text, language=self.language, speaker=self.speaker, speed=self.speed
+            )
+            return np.asarray(wav, dtype=np.float32)
+        gpt_cond_latent, speaker_embedding = self.conditioning()
+        config = self.model.config
+        output = self.model.inference(
+            text,
+            self.language,
+            gpt_cond_latent,
+            speaker_embedding,
+            temperature=config.temperature,
+            length_penalty=config.length_penalty,
+            repetition_penalty=config.repetition_penalty,
+            top_k=config.top_k,
+            top_p=config.top_p,
+            speed=self.speed,
+        )
+        wav = np.asarray(output["wav"], dtype=np.float32)
+        return np.concatenate([wav, np.zeros(SENTENCE_PAUSE, dtype=np.float32)])
+
+    @torch.inference_mode()
+    def _synthesize_batch(self, tokens: list[list[int]]) -> list[np.ndarray]:
+        model = self.model
+        gpt = model.gpt
+        device = model.device
+        config = model.config
+        gpt_cond_latent, speaker_embedding = self.conditioning()
+        batch_size = len(tokens)
+
+        # Stessa lunghezza per tutti i testi (vedi group()): nessun padding
+        text_inputs = torch.tensor(tokens, dtype=torch.int32, device=device)
+        text_lengths = torch.full(
+            (batch_size,), text_inputs.shape[1], dtype=torch.long, device=device
+        )
+        cond_latents = gpt_cond_latent.expand(batch_size, -1, -1)
+
+        codes = gpt.generate(
+            cond_latents=cond_latents,
+            text_inputs=text_inputs,
+            input_tokens=None,
+            do_sample=True,
+            top_p=config.top_p,
+            top_k=config.top_k,
+            temperature=config.temperature,
+            num_return_sequences=1,
+            num_beams=1,
+            length_penalty=config.length_penalty,
+            repetition_penalty=config.repetition_penalty,
+            output_attentions=False,
+        )
+        # ogni sequenza termina al primo stop_audio_token
+        stops = codes == gpt.stop_audio_token
+        code_lengths = torch.where(
+            stops.any(dim=1), stops.int().argmax(dim=1), torch.full_like(text_lengths, codes.shape[1])
+        )
+        wav_lengths = code_lengths * gpt.code_stride_len
+        latents = gpt(
+            text_inputs,
+            text_lengths,
+            codes,
+            wav_lengths,
+            cond_latents=cond_latents,
+            return_attentions=False,
+            return_latent=True,
+        )
+
+        length_scale = 1.0 / max(self.speed, 0.05)
+        wavs = []
+        for i in range(batch_size):
+            latent = latents[i : i + 1, : int(code_lengths[i])]
+            if length_scale != 1.0:
+                latent = F.interpolate(
+                    latent.transpose(1, 2), scale_factor=length_scale, mode="linear"
+                ).transpose(1, 2)
+            wav = model.hifigan_decoder(latent, g=speaker_embedding).cpu().squeeze().numpy()
+            wavs.append(
+                np.concatenate([wav, np.zeros(SENTENCE_PAUSE)]).astype(np.float32)
+            )
+        return wavs
+
+
+class BatchScheduler:
+    """
+    Raccoglie i frammenti richiesti in contemporanea e li sintetizza in batch.
+
+    Le richieste che arrivano entro max_wait secondi l'una dall'altra finiscono
+    nello stesso giro; il modello viene usato da un solo thread alla volta.
+    """
+
+    def __init__(self, synthesize, max_wait=0.02):
+        self.synthesize = synthesize
+        self.max_wait = max_wait
+        self.pending = []
+        self.task = None
+
+    async def submit(self, text: str) -> np.ndarray:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((text, future))
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        return await future
+
+    async def _run(self):
+        while self.pending:
+            await asyncio.sleep(self.max_wait)
+            batch, self.pending = self.pending, []
+            texts = [text for text, _ in batch]
+            try:
+                wavs = await asyncio.to_thread(self.synthesize, texts)
+                for (_, future), wav in zip(batch, wavs):
+                    if not future.done():
+                        future.set_result(wav)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
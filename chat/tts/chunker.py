@@ -0,0 +1,145 @@
+import math
+import re
+from functools import lru_cache
+
+import tiktoken
+
+# Confini su cui spezzare il testo, dal più naturale al meno naturale
+SENTENCE = re.compile(r"(?<=[.!?;:])\s+")
+CLAUSE = re.compile(r"(?<=[,)\]»])\s+|\s+(?=[–—-]\s)")
+WORD = re.compile(r"\s+")
+SPLITTERS = (SENTENCE, CLAUSE, WORD)
+
+# Penalità per un taglio dopo fine frase, inciso, parola o a metà parola
+BOUNDARY_PENALTY = (0.0, 0.1, 0.5, 5.0)
+
+
+@lru_cache(maxsize=None)
+def get_encoder(encoding: str = "cl100k_base"):
+    """Restituisce l'encoder tiktoken, creato una sola volta per processo."""
+    return tiktoken.get_encoding(encoding)
+
+
+class TextChunker:
+    """
+    Divide il testo da sintetizzare in frammenti sotto il limite di token.
+
+    Il testo viene tagliato solo ai confini di frase, poi di inciso, poi di
+    parola; a metà parola solo se una singola parola supera il limite. Tra
+    tutti i tagli possibili viene scelto quello che rende i frammenti più
+    simili in lunghezza, così i worker del TTS finiscono in tempi simili e i
+    batch sono più uniformi.
+    """
+
+    def __init__(self, max_tokens: int = 200, encoding: str = "cl100k_base"):
+        self.max_tokens = max_tokens
+        self.encoder = get_encoder(encoding)
+
+    def count(self, text: str) -> int:
+        return len(self.encoder.encode(text))
+
+    def split(self, text: str) -> list[str]:
+        """
+        Divide il testo in frammenti bilanciati.
+
+        Args:
+            text (str): Il testo da dividere
+
+        Returns:
+            list[str]: I frammenti, ognuno entro max_tokens
+        """
+        text = text.strip()
+        if not text:
+            return []
+        total = self.count(text)
+        if total <= self.max_tokens:
+            return [text]
+        pieces = self._pieces(text, 0, 0)
+        n_chunks = math.ceil(sum(p[1] for p in pieces) / self.max_tokens)
+        while True:
+            chunks = self._balance(pieces, n_chunks)
+            if chunks is not None:
+                return chunks
+            n_chunks += 1
+
+    def _pieces(
+        self, text: str, level: int, boundary: int
+    ) -> list[tuple[str, int, int]]:
+        """
+        Scompone il testo in frasi e incisi (testo, token, forza del confine
+        successivo); scende a parole e token solo per i pezzi oltre il limite.
+        """
+        tokens = self.count(text)
+        if tokens <= self.max_tokens and level >= SPLITTERS.index(WORD):
+            return [(text, tokens, boundary)]
+        if level == len(SPLITTERS):
+            ids = self.encoder.encode(text)
+            windows = range(0, len(ids), self.max_tokens)
+            return [
+                (
+                    self.encoder.decode(ids[i : i + self.max_tokens]),
+                    len(ids[i : i + self.max_tokens]),
+                    boundary if i == windows[-1] else len(SPLITTERS),
+                )
+                for i in windows
+            ]
+        parts = [p for p in SPLITTERS[level].split(text) if p]
+        pieces = []
+        for i, part in enumerate(parts):
+            last = i == len(parts) - 1
+            pieces.extend(self._pieces(part, level + 1, boundary if last else level))
+        return pieces
+
+    def _balance(
+        self, pieces: list[tuple[str, int, int]], n_chunks: int
+    ) -> list[str] | None:
+        """
+        Raggruppa i pezzi consecutivi in n_chunks frammenti entro il limite,
+        minimizzando lo scarto dalla lunghezza media e i tagli poco naturali.
+        Restituisce None se non è possibile.
+        """
+        n = len(pieces)
+        if n_chunks > n:
+            return None
+        prefix = [0]
+        for _, tokens, _ in pieces:
+            prefix.append(prefix[-1] + tokens + 1)  # +1 per lo spazio di separazione
+        target = prefix[-1] / n_chunks
+
+        def cost(start, end):
+            length = prefix[end] - prefix[start] - 1
+            if length > self.max_tokens:
+                return math.inf
+            penalty = BOUNDARY_PENALTY[pieces[end - 1][2]] if end < n else 0.0
+            return ((length - target) / target) ** 2 + penalty
+
+        best = [[math.inf] * (n + 1) for _ in range(n_chunks + 1)]
+        cut = [[0] * (n + 1) for _ in range(n_chunks + 1)]
+        best[0][0] = 0.0
+        for j in range(1, n_chunks + 1):
+            for end in range(j, n + 1):
+                for start in range(end - 1, j - 2, -1):
+                    if prefix[end] - prefix[start] - 1 > self.max_tokens:
+                        break
+                    value = best[j - 1][start] + cost(start, end)
+                    if value < best[j][end]:
+                        best[j][end] = value
+                        cut[j][end] = start
+        if best[n_chunks][n] == math.inf:
+            return None
+
+        chunks = []
+        end = n
+        for j in range(n_chunks, 0, -1):
+            start = cut[j][end]
+            chunks.append(self._join(pieces[start:end]))
+            end = start
+        return chunks[::-1]
+
+    @staticmethod
+    def _join(pieces: list[tuple[str, int, int]]) -> str:
+        text = pieces[0][0]
+        for previous, piece in zip(pieces, pieces[1:]):
+            # i pezzi tagliati a metà parola mantengono già i propri spazi
+            text += piece[0] if previous[2] == len(SPLITTERS) else " " + piece[0]
+        return text
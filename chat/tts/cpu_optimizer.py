@@ -0,0 +1,68 @@
+import torch
+from torch import nn
+from transformers.pytorch_utils import Conv1D
+
+from utilities.colorize import color
+
+
+def _conv1d_to_linear(module: nn.Module) -> int:
+    """
+    Sostituisce i Conv1D di transformers (usati dal GPT-2 di XTTS) con nn.Linear
+    equivalenti, altrimenti la quantizzazione dinamica non li vedrebbe.
+    """
+    replaced = 0
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            n_in, n_out = child.weight.shape
+            linear = nn.Linear(n_in, n_out)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+            replaced += 1
+        else:
+            replaced += _conv1d_to_linear(child)
+    return replaced
+
+
+def optimize_for_cpu(model: nn.Module, config: dict) -> nn.Module:
+    """
+    Prepara il modello XTTS per l'inferenza su CPU.
+
+    Args:
+        model (nn.Module): Il modello TTS (tts.synthesizer.tts_model)
+        config (dict): La sezione "cpu_mode" del file di configurazione
+
+    Returns:
+        nn.Module: Il modello ottimizzato
+    """
+    threads = config.get("threads", 0)
+    if threads:
+        torch.set_num_threads(threads)
+    model.eval()
+
+    if config.get("quantize", False):
+        for name in ("gpt", "hifigan_decoder"):
+            submodule = getattr(model, name, None)
+            if submodule is None:
+                continue
+            replaced = _conv1d_to_linear(submodule)
+            torch.ao.quantization.quantize_dynamic(
+                submodule, {nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+            print(
+                color("[CPU MODE]", True, "cyan"),
+                f": {name} quantized to int8 ({replaced} Conv1D converted)",
+                sep="",
+            )
+
+    if config.get("compile", False) and hasattr(model, "hifigan_decoder"):
+        # la generazione autoregressiva del GPT non beneficia di torch.compile
+        model.hifigan_decoder = torch.compile(model.hifigan_decoder)
+        print(color("[CPU MODE]", True, "cyan"), ": hifigan_decoder compiled", sep="")
+
+    print(
+        color("[CPU MODE]", True, "cyan"),
+        f": CPU mode enabled ({torch.get_num_threads()} threads)",
+        sep="",
+    )
+    return model
@@ -0,0 +1,119 @@
+import asyncio
+import heapq
+from collections import deque
+
+from utilities.tts_utilities import TextFragment
+
+
+class Job:
+    """Rappresenta un frammento di testo in attesa di sintesi."""
+
+    def __init__(self, fragment: TextFragment):
+        self.fragment = fragment
+        self.attempts = 0
+
+    @property
+    def key(self) -> tuple:
+        return (self.fragment.request, self.fragment.id, self.fragment.sub_id or 0)
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    def __repr__(self):
+        return f"Job {self.key} (attempts={self.attempts})"
+
+
+class JobQueue:
+    """
+    Coda con priorità dei frammenti da sintetizzare.
+
+    Ogni richiesta ha il proprio heap ordinato per (id, sub_id), quindi la prima
+    frase di una risposta viene sempre estratta prima delle successive. Tra
+    richieste diverse i job vengono estratti a turno (round robin), così una
+    risposta lunga non blocca le altre sessioni.
+    """
+
+    def __init__(self, n_workers: int, timeout: float = 60, max_retries: int = 2):
+        self.heaps: dict[str, list[Job]] = {}
+        self.turns: deque[str] = deque()  # richieste con job in attesa, in ordine di turno
+        self.in_flight: dict[tuple, Job] = {}
+        self.cancelled: set[str] = set()
+        self.n_workers = n_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.condition = asyncio.Condition()
+
+    def _push(self, job: Job):
+        request = job.fragment.request
+        heap = self.heaps.get(request)
+        if heap is None:
+            heap = self.heaps[request] = []
+            self.turns.append(request)
+        heapq.heappush(heap, job)
+
+    async def put(self, fragment: TextFragment):
+        """Aggiunge un frammento alla coda."""
+        async with self.condition:
+            self.cancelled.discard(fragment.request)
+            self._push(Job(fragment))
+            self.condition.notify()
+
+    async def get(self) -> Job:
+        """Estrae il prossimo job, attendendo se la coda è vuota."""
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.turns)
+            request = self.turns.popleft()
+            heap = self.heaps[request]
+            job = heapq.heappop(heap)
+            if heap:
+                self.turns.append(request)
+            else:
+                del self.heaps[request]
+            self.in_flight[job.key] = job
+            return job
+
+    def done(self, job: Job):
+        """Segna un job come terminato."""
+        self.in_flight.pop(job.key, None)
+
+    async def retry(self, job: Job) -> bool:
+        """Rimette in coda un job fallito, se ha ancora tentativi disponibili."""
+        self.done(job)
+        job.attempts += 1
+        if job.attempts > self.max_retries or self.is_cancelled(job.key):
+            return False
+        async with self.condition:
+            self._push(job)
+            self.condition.notify()
+        return True
+
+    def cancel(self, request: str | None = None) -> int:
+        """Rimuove i job in attesa di una richiesta (o di tutte) e ne scarta quelli in corso."""
+        requests = list(self.heaps) if request is None else [request]
+        if request is None:
+            self.cancelled.update(k[0] for k in self.in_flight)
+        self.cancelled.update(requests)
+        removed = sum(len(self.heaps.pop(r, [])) for r in requests)
+        self.turns = deque(r for r in self.turns if r in self.heaps)
+        self.in_flight = {
+            k: j for k, j in self.in_flight.items() if k[0] not in self.cancelled
+        }
+        return removed
+
+    def forget(self, request: str):
+        """Dimentica una richiesta annullata, ad esempio quando la sessione scade."""
+        self.cancelled.discard(request)
+
+    def is_cancelled(self, key: tuple) -> bool:
+        return key[0] in self.cancelled
+
+    def is_idle(self, request: str | None = None) -> bool:
+        """Verifica se non ci sono job in attesa o in corso (per una richiesta o in totale)."""
+        if request is None:
+            return not self.heaps and not self.in_flight
+        return request not in self.heaps and not any(
+            k[0] == request for k in self.in_flight
+        )
+
+    def __len__(self):
+        return sum(len(h) for h in self.heaps.values())
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+
+from chat.tts.audio_buffer import AudioBuffer
+from chat.tts.audio_maker import AudioMaker
+from chat.tts.audio_store import AudioStore
+from chat.tts.job_queue import JobQueue
+from utilities.colorize import color
+from utilities.tts_utilities import TextFragment
+
+
+class EmbeddedPipeline:
+    """
+    Pipeline TTS eseguita nello stesso processo del chatbot.
+
+    L'handler inserisce le frasi in una asyncio.Queue, da cui vengono suddivise
+    e passate alla JobQueue dell'AudioBuffer; i worker del buffer chiamano
+    direttamente l'AudioMaker locale, senza passare dai servizi FastAPI.
+    Coda e worker girano su un event loop dedicato, così la pipeline può essere
+    condivisa da sessioni Streamlit che usano loop diversi.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.maker = AudioMaker(config)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self._call(self._start()).result()
+        print(
+            color("[TTS PIPELINE]", True, "cyan"), ": Embedded pipeline initialized", sep=""
+        )
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def _start(self):
+        self.queue = asyncio.Queue()
+        job_queue = JobQueue(
+            self.config["limit"], self.config["job_timeout"], self.config["job_retries"]
+        )
+        self.buffer = AudioBuffer(
+            job_queue,
+            self.config["max_tokens"],
+            maker=self.maker,
+            store=AudioStore(
+                self.config["audio_store"]["format"],
+                self.config["audio_store"]["subtype"],
+                self.config["audio_store"]["max_mb"],
+            ),
+            session_ttl=self.config["session_ttl"],
+        )
+        self.buffer.start_workers()
+        self.ingest_task = asyncio.create_task(self._ingest())
+
+    async def _ingest(self):
+        while True:
+            text = await self.queue.get()
+            try:
+                chunks = self.buffer.split_text_into_chunks(text.text)
+                for i, c in enumerate(chunks):
+                    await self.buffer.add_text(TextFragment(c, text.id, i, text.request))
+            except Exception as e:
+                print(color("[TTS PIPELINE]", True, "red"), ": Error:", e)
+            finally:
+                self.queue.task_done()
+
+    async def put(self, text):
+        """Accoda una frase (TextRequest) da sintetizzare."""
+        await asyncio.wrap_future(self._call(self.queue.put(text)))
+
+    async def finish(self, request: str, poll_interval: float = 0.05) -> int | None:
+        """Attende che tutte le frasi della richiesta siano sintetizzate e ne salva l'audio."""
+        return await asyncio.wrap_future(self._call(self._finish(request, poll_interval)))
+
+    async def _finish(self, request: str, poll_interval: float) -> int | None:
+        await self.queue.join()
+        while not await self.buffer.is_complete(request):
+            await asyncio.sleep(poll_interval)
+        return await self.buffer.save_audio(request)
+
+    async def get_audio(self, request: str) -> bytes | None:
+        """Restituisce l'audio compresso di una richiesta completata."""
+        return await asyncio.wrap_future(self._call(self._get_audio(request)))
+
+    async def _get_audio(self, request: str) -> bytes | None:
+        return self.buffer.store.get(request)
+
+    async def cancel(self, request: str | None = None) -> int:
+        """Annulla le frasi ancora da sintetizzare."""
+        return await asyncio.wrap_future(self._call(self._cancel(request)))
+
+    async def _cancel(self, request: str | None) -> int:
+        kept = []
+        while not self.queue.empty():
+            text = self.queue.get_nowait()
+            self.queue.task_done()
+            if request is not None and text.request != request:
+                kept.append(text)
+        for text in kept:
+            self.queue.put_nowait(text)
+        removed = self.buffer.cancel(request)
+        await self.buffer.clear(request)
+        return removed
+
+    def stop(self):
+        """Ferma worker ed event loop della pipeline."""
+        self._call(self._stop()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def _stop(self):
+        self.ingest_task.cancel()
+        await asyncio.gather(self.ingest_task, return_exceptions=True)
+        await self.buffer.stop_workers()
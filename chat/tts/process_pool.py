@@ -0,0 +1,254 @@
+import asyncio
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+
+from chat.tts.audio_maker import AudioMaker
+from utilities.colorize import color
+
+POLL_INTERVAL = 1.0  # secondi tra un controllo dei worker e l'altro
+
+
+def _worker_main(worker_id, config, n_threads, cores, tasks, results):
+    """Processo worker: carica il modello una volta e sintetizza i testi in coda."""
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(n_threads)
+    worker_config = {
+        **config,
+        "cache": {"enabled": False},
+        "batching": {"enabled": False},
+    }
+    try:
+        maker = AudioMaker(worker_config)
+    except Exception as e:
+        results.put(("error", worker_id, None, None, 0, str(e)))
+        return
+    results.put(("ready", worker_id, None, None, 0, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        job_id, text = task
+        # Il processo principale sa quale job fallire se il worker muore
+        results.put(("taken", worker_id, job_id, None, 0, None))
+        try:
+            with torch.inference_mode():
+                wav = maker.synthesizer.synthesize_one(text)
+            shm = shared_memory.SharedMemory(create=True, size=max(wav.nbytes, 1))
+            np.ndarray(wav.shape, dtype=np.float32, buffer=shm.buf)[:] = wav
+            results.put(("done", worker_id, job_id, shm.name, len(wav), None))
+            shm.close()
+        except Exception as e:
+            results.put(("done", worker_id, job_id, None, 0, str(e)))
+
+
+class ProcessPoolEngine:
+    """
+    Pool di processi per la sintesi TTS su CPU.
+
+    Ogni worker carica il modello una sola volta, usa un numero fisso di thread
+    torch ed è vincolato ai propri core. I testi arrivano su una coda IPC e il
+    PCM torna al processo principale tramite shared memory.
+    """
+
+    def __init__(
+        self,
+        config,
+        n_workers=2,
+        threads_per_worker=2,
+        pin_cores=True,
+        start_timeout=600,
+    ):
+        self.config = config
+        self.n_workers = n_workers
+        self.threads_per_worker = threads_per_worker
+        self.pin_cores = pin_cores
+        self.start_timeout = start_timeout  # secondi per il caricamento dei modelli
+        self.context = mp.get_context("spawn")
+        self.tasks = self.context.Queue()
+        self.results = self.context.Queue()
+        self.processes = []
+        self.futures = {}
+        self.running = {}  # worker -> job in corso
+        self.dead = set()
+        self.ids = itertools.count()
+        self.reader = None
+        self.stopping = False
+
+    def _cores(self, worker_id: int) -> list[int]:
+        if not self.pin_cores or not hasattr(os, "sched_getaffinity"):
+            return []
+        available = sorted(os.sched_getaffinity(0))
+        start = worker_id * self.threads_per_worker
+        return [
+            available[(start + i) % len(available)] for i in range(self.threads_per_worker)
+        ]
+
+    def start(self):
+        """
+        Avvia i worker e attende che abbiano caricato il modello. Se un worker
+        fallisce, muore o non è pronto entro start_timeout, ferma il pool e
+        solleva RuntimeError.
+        """
+        for worker_id in range(self.n_workers):
+            process = self.context.Process(
+                target=_worker_main,
+                args=(
+                    worker_id,
+                    self.config,
+                    self.threads_per_worker,
+                    self._cores(worker_id),
+                    self.tasks,
+                    self.results,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+        try:
+            self._wait_ready()
+        except Exception:
+            self.stop()
+            raise
+        self.reader = threading.Thread(target=self._read_results, daemon=True)
+        self.reader.start()
+
+    def _wait_ready(self):
+        ready = set()
+        deadline = time.monotonic() + self.start_timeout
+        while len(ready) < self.n_workers:
+            try:
+                message = self.results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                for worker_id, process in enumerate(self.processes):
+                    if worker_id not in ready and not process.is_alive():
+                        raise RuntimeError(
+                            f"Worker {worker_id} terminated while loading the model"
+                            f" (exit code {process.exitcode})"
+                        )
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Workers not ready after {self.start_timeout}s")
+                continue
+            kind, worker_id, _, _, _, error = message
+            if kind == "error":
+                raise RuntimeError(
+                    f"Worker {worker_id} failed to load the model: {error}"
+                )
+            ready.add(worker_id)
+            print(
+                color("[PROCESS POOL]", True, "cyan"),
+                f": Worker {worker_id} ready (cores {self._cores(worker_id) or 'any'})",
+                sep="",
+            )
+
+    def _alive(self) -> bool:
+        return len(self.dead) < len(self.processes)
+
+    async def submit(self, text: str) -> np.ndarray:
+        """Invia un testo a un worker e attende il PCM generato."""
+        if not self._alive():
+            raise RuntimeError("No process pool worker alive")
+        loop = asyncio.get_running_loop()
+        job_id = next(self.ids)
+        future = loop.create_future()
+        self.futures[job_id] = (loop, future)
+        self.tasks.put((job_id, text))
+        return await future
+
+    def _read_results(self):
+        while not self.stopping:
+            try:
+                message = self.results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                message = ()
+            if message is None:
+                break
+            if message:
+                try:
+                    self._handle(message)
+                except Exception as e:
+                    # Un errore di lettura fallisce solo il job del messaggio
+                    print(color("[PROCESS POOL]", True, "red"), ": Error:", e)
+                    self._fail(message[2], f"Error reading the synthesis result: {e}")
+            # Controllo a ogni iterazione: con la coda sempre piena un timeout
+            # potrebbe non arrivare mai
+            self._check_workers()
+
+    def _handle(self, message):
+        kind, worker_id, job_id, shm_name, length, error = message
+        if kind == "taken":
+            self.running[worker_id] = job_id
+            return
+        self.running.pop(worker_id, None)
+        wav = None
+        if shm_name is not None:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            try:
+                wav = np.ndarray((length,), dtype=np.float32, buffer=shm.buf).copy()
+            finally:
+                shm.close()
+                shm.unlink()
+        loop, future = self.futures.pop(job_id, (None, None))
+        if future is None:
+            return
+        if error is not None:
+            loop.call_soon_threadsafe(_set_exception, future, Exception(error))
+        else:
+            loop.call_soon_threadsafe(_set_result, future, wav)
+
+    def _check_workers(self):
+        """Fallisce i job dei worker terminati, e tutti se non ne resta nessuno."""
+        for worker_id, process in enumerate(self.processes):
+            if worker_id in self.dead or process.is_alive():
+                continue
+            self.dead.add(worker_id)
+            print(
+                color("[PROCESS POOL]", True, "red"),
+                f": Worker {worker_id} terminated (exit code {process.exitcode})",
+                sep="",
+            )
+            job_id = self.running.pop(worker_id, None)
+            if job_id is not None:
+                self._fail(job_id, f"Worker {worker_id} terminated during synthesis")
+        if self.processes and not self._alive():
+            for job_id in list(self.futures):
+                self._fail(job_id, "No process pool worker alive")
+
+    def _fail(self, job_id, message: str):
+        loop, future = self.futures.pop(job_id, (None, None))
+        if future is not None:
+            loop.call_soon_threadsafe(_set_exception, future, RuntimeError(message))
+
+    def stop(self):
+        """Ferma i worker e il thread di lettura."""
+        self.stopping = True
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        if self.reader is not None:
+            self.results.put(None)
+            self.reader.join(timeout=10)
+            self.reader = None
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, exception):
+    if not future.done():
+        future.set_exception(exception)
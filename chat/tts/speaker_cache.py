@@ -0,0 +1,88 @@
+import hashlib
+import os
+
+import torch
+
+from utilities.colorize import color
+
+
+class SpeakerCache:
+    """
+    Latenti di condizionamento XTTS precalcolati per gli speaker configurati.
+
+    Per gli speaker predefiniti del modello i latenti vengono letti dallo
+    speaker manager, per i file .wav vengono calcolati con
+    get_conditioning_latents. In entrambi i casi restano in memoria già sul
+    device del modello e, se è indicata una cartella, vengono salvati su disco.
+    """
+
+    def __init__(self, model, model_name: str, directory: str | None = None):
+        self.model = model
+        self.model_name = model_name
+        self.directory = directory
+        self.latents: dict[str, tuple[torch.Tensor, torch.Tensor]] = {}
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def load(self, speakers: list[str]):
+        """Precalcola i latenti di tutti gli speaker."""
+        for speaker in speakers:
+            self.get(speaker)
+        print(
+            color("[SPEAKER CACHE]", True, "cyan"),
+            f": Conditioning latents ready for {len(self.latents)} speakers",
+            sep="",
+        )
+
+    def get(self, speaker: str) -> tuple[torch.Tensor, torch.Tensor]:
+        """Restituisce (gpt_cond_latent, speaker_embedding) dello speaker."""
+        latents = self.latents.get(speaker)
+        if latents is None:
+            latents = self._load_from_disk(speaker)
+            if latents is None:
+                latents = self._compute(speaker)
+                self._save_to_disk(speaker, latents)
+            device = self.model.device
+            latents = tuple(t.to(device) for t in latents)
+            self.latents[speaker] = latents
+        return latents
+
+    @torch.inference_mode()
+    def _compute(self, speaker: str) -> tuple[torch.Tensor, torch.Tensor]:
+        if os.path.isfile(speaker):
+            return self.model.get_conditioning_latents(audio_path=[speaker])
+        latents = self.model.speaker_manager.speakers[speaker]
+        return latents["gpt_cond_latent"], latents["speaker_embedding"]
+
+    def _path(self, speaker: str) -> str:
+        key = f"{self.model_name}\x1f{speaker}"
+        if os.path.isfile(speaker):
+            key += f"\x1f{os.path.getmtime(speaker)}"
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pth")
+
+    def _load_from_disk(self, speaker: str):
+        if not self.directory or not os.path.exists(self._path(speaker)):
+            return None
+        try:
+            data = torch.load(self._path(speaker), map_location="cpu")
+            return data["gpt_cond_latent"], data["speaker_embedding"]
+        except Exception as e:
+            print(color("[SPEAKER CACHE]", True, "red"), ": Error:", e)
+            return None
+
+    def _save_to_disk(self, speaker: str, latents):
+        if not self.directory:
+            return
+        gpt_cond_latent, speaker_embedding = latents
+        path = self._path(speaker)
+        # Più processi (i worker del process pool) possono scrivere lo stesso
+        # file: ognuno scrive il proprio temporaneo e lo sostituisce atomicamente
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.save(
+            {
+                "gpt_cond_latent": gpt_cond_latent.cpu(),
+                "speaker_embedding": speaker_embedding.cpu(),
+            },
+            tmp_path,
+        )
+        os.replace(tmp_path, path)
@@ -0,0 +1,294 @@
+import argparse
+import asyncio
+import copy
+import gc
+import json
+import tracemalloc
+from time import perf_counter
+
+import faiss
+import numpy as np
+from langchain_community.docstore import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from chat.chatbot.graph import App, Graph, Router
+from chat.chatbot.retriever import RetrieverBuilder
+from utilities.chunks import render_chunk
+from utilities.colorize import color
+from utilities.providers import make_chat_model, make_embedder
+from utilities.utilities import ChatHistory, StdOutHandler, load_config
+
+
+class TimingHandler(StdOutHandler):
+    """StdOutHandler senza audio che registra l'arrivo del primo token."""
+
+    def start(self, containers=None):
+        super().start(containers)
+        self.first_token = None
+
+    async def on_new_token(self, token) -> None:
+        if self.first_token is None and getattr(token, "content", ""):
+            self.first_token = perf_counter()
+        await super().on_new_token(token)
+
+
+def build_vectorstore(documents: list[dict], embedder) -> FAISS:
+    """Indice in memoria con i documenti del corpus registrato."""
+    docs = [
+        Document(
+            page_content=d["text"],
+            metadata={
+                "title": d["title"],
+                "source": d["source"],
+                "id": i,
+                "chunk_id": f"benchmark-{i}",
+                "seq": 0,
+            },
+        )
+        for i, d in enumerate(documents)
+    ]
+    vectors = embedder.embed_documents([render_chunk(d) for d in docs])
+    vectorstore = FAISS(
+        embedding_function=embedder,
+        index=faiss.IndexFlatL2(len(vectors[0])),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+    vectorstore.add_embeddings(
+        [(d.page_content, v) for d, v in zip(docs, vectors)],
+        metadatas=[d.metadata for d in docs],
+        ids=[d.metadata["chunk_id"] for d in docs],
+    )
+    return vectorstore
+
+
+def build_app(config: dict, corpus: dict, use_db: bool) -> App:
+    """Stessa costruzione di Session.initialize_session_state, senza Streamlit e TTS."""
+    if use_db:
+        retriever = RetrieverBuilder.build(config)
+    else:
+        embedder = make_embedder(config)
+        vectorstore = build_vectorstore(corpus["documents"], embedder)
+        retriever = RetrieverBuilder.from_vectorstore(config, vectorstore, embedder)
+    llm = make_chat_model(config)
+    handler = TimingHandler(config, audio=False, debug=False)
+    graph_config = {
+        "configurable": {
+            "thread_id": "benchmark",
+            "handler": handler,
+            "history": ChatHistory(config["history_size"]),
+            "followup_threshold": config["followup_threshold"],
+        },
+        "history_size": config["history_size"],
+        "recursion_limit": 15,
+    }
+    graph = Graph(llm, Router(llm), retriever, False, graph_config)
+    return App(graph)
+
+
+def route_of(state: dict) -> str:
+    """Percorso seguito nel grafo, ricavato dallo stato finale."""
+    if state.get("type") in ("summary", "denial"):
+        return state["type"]
+    if state.get("context"):
+        return "rag+transformation" if state.get("transformed_query") else "rag"
+    return "conversational"
+
+
+def counters(app: App) -> dict[str, int]:
+    retriever = app.graph.retriever
+    return {
+        "llm": getattr(app.graph.llm, "calls", 0),
+        "embed": getattr(retriever.embedder, "calls", 0),
+        "rerank": getattr(retriever.compressor, "calls", 0),
+    }
+
+
+async def run_turn(app: App, text: str) -> dict:
+    handler = app.handler
+    before = counters(app)
+    start = perf_counter()
+    try:
+        state = await app.run({"messages": ("user", text)})
+        error = None
+    except Exception as e:
+        state, error = {}, str(e)
+    latency = perf_counter() - start
+    after = counters(app)
+    first_token = handler.first_token
+    return {
+        "text": text,
+        "path": route_of(state) if state else "error",
+        "latency": latency,
+        "ttft": first_token - start if first_token is not None else None,
+        "calls": {k: after[k] - before[k] for k in after},
+        "error": error,
+    }
+
+
+def new_session(app: App, name: str):
+    """Conversazione indipendente: nuovo thread del grafo e cronologia vuota."""
+    app.config["configurable"]["thread_id"] = name
+    app.config["configurable"]["history"].clear()
+
+
+async def replay(app: App, conversations: list[dict]) -> list[dict]:
+    turns = []
+    for conversation in conversations:
+        new_session(app, conversation["name"])
+        for turn in conversation["turns"]:
+            result = await run_turn(app, turn["text"])
+            result.update(conversation=conversation["name"], route=turn["route"])
+            turns.append(result)
+    return turns
+
+
+async def long_session(app: App, conversations: list[dict], repeat: int) -> dict:
+    """
+    Ripete tutte le conversazioni in un'unica sessione e misura la memoria
+    Python allocata dopo ogni ripetizione.
+    """
+    new_session(app, "long-session")
+    texts = [t["text"] for c in conversations for t in c["turns"]]
+    tracemalloc.start()
+    samples = []
+    try:
+        for _ in range(repeat):
+            for text in texts:
+                await run_turn(app, text)
+            gc.collect()
+            samples.append(tracemalloc.get_traced_memory()[0])
+    finally:
+        tracemalloc.stop()
+    turns = repeat * len(texts)
+    growth = samples[-1] - samples[0] if samples else 0
+    return {
+        "turns": turns,
+        "samples_bytes": samples,
+        "growth_bytes": growth,
+        "growth_per_turn_bytes": growth / max(turns - len(texts), 1),
+    }
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    return float(np.percentile(values, q)) if values else None
+
+
+def summarize(turns: list[dict]) -> dict:
+    routes = {}
+    for route in dict.fromkeys(t["route"] for t in turns):
+        group = [t for t in turns if t["route"] == route]
+        latencies = [t["latency"] for t in group if not t["error"]]
+        ttfts = [t["ttft"] for t in group if t["ttft"] is not None]
+        paths = {}
+        for t in group:
+            paths[t["path"]] = paths.get(t["path"], 0) + 1
+        routes[route] = {
+            "turns": len(group),
+            "errors": sum(1 for t in group if t["error"]),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "ttft_p50": percentile(ttfts, 50),
+            "ttft_p95": percentile(ttfts, 95),
+            "calls_per_turn": {
+                k: float(np.mean([t["calls"][k] for t in group]))
+                for k in ("llm", "embed", "rerank")
+            },
+            "paths": paths,
+        }
+    return routes
+
+
+def local_config(args) -> tuple[dict, dict]:
+    """Configurazione del chatbot con i sostituti locali e il corpus registrato."""
+    config = copy.deepcopy(load_config(args.config))
+    with open(args.conversations, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+    providers = config.setdefault("providers", {})
+    providers.update(embedder="hashing", reranker="lexical", llm="fake")
+    local = providers["local"]
+    local["rules"] = corpus["llm_rules"]
+    if args.llm_latency is not None:
+        local["llm_latency"] = args.llm_latency
+    if args.tokens_per_second is not None:
+        local["tokens_per_second"] = args.tokens_per_second
+    config["graph_verbose"] = False
+    return config, corpus
+
+
+async def run(args) -> dict:
+    config, corpus = local_config(args)
+    app = build_app(config, corpus, args.db)
+    conversations = corpus["conversations"]
+
+    for _ in range(args.warmup):
+        await replay(app, conversations)
+    turns = []
+    for _ in range(args.rounds):
+        turns += await replay(app, conversations)
+    memory = await long_session(app, conversations, args.repeat)
+
+    local = config["providers"]["local"]
+    return {
+        "config": {
+            "rounds": args.rounds,
+            "warmup": args.warmup,
+            "db": config["db"] if args.db else "corpus",
+            "llm_latency": local["llm_latency"],
+            "tokens_per_second": local["tokens_per_second"],
+            "embed_latency": local["embed_latency"],
+            "rerank_latency": local["rerank_latency"],
+        },
+        "routes": summarize(turns),
+        "memory": memory,
+        "turns": turns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end del chatbot")
+    parser.add_argument("--config", default="./chat/chatbot/config.yaml")
+    parser.add_argument(
+        "--conversations", default="./chat/chatbot/benchmark_conversations.json"
+    )
+    parser.add_argument(
+        "--db",
+        action="store_true",
+        help="Usa il database in config (creato con provider 'hashing')",
+    )
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument(
+        "--repeat", type=int, default=20, help="Ripetizioni della sessione lunga"
+    )
+    parser.add_argument("--llm-latency", type=float)
+    parser.add_argument("--tokens-per-second", type=float)
+    parser.add_argument("--output", help="Salva i risultati in JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+
+    def seconds(value: float | None) -> str:
+        return f"{value:.3f}s" if value is not None else "n/a"
+
+    for route, stats in report["routes"].items():
+        print(
+            f"{route:<16} n={stats['turns']:<4} p50 {seconds(stats['p50'])}"
+            f"  p95 {seconds(stats['p95'])}  TTFT p50 {seconds(stats['ttft_p50'])}"
+            f"  errors {stats['errors']}"
+        )
+    memory = report["memory"]
+    print(
+        color("[BENCHMARK]", True, "green"),
+        f": {memory['turns']} turns in one session,"
+        f" {memory['growth_per_turn_bytes'] / 1024:.1f} KB growth per turn",
+        sep="",
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import json
+from time import perf_counter
+
+import numpy as np
+import torch
+
+from chat.tts.audio_maker import AudioMaker
+from utilities.colorize import color
+from utilities.utilities import load_config
+
+SENTENCES = [
+    "Buongiorno, sono Azzurra, come posso aiutarti?",
+    "Il concorso per ufficiali prevede una prova scritta e una prova orale.",
+    "Non so rispondere a questa domanda.",
+    "L'iter formativo dei piloti dura in totale circa cinque anni, tra teoria e volo.",
+    "Prego, resto a disposizione per qualsiasi altra informazione.",
+]
+
+
+def spectral_profile(wav: np.ndarray, n_fft=1024, hop=256) -> np.ndarray:
+    """Spettro medio in scala logaritmica, indipendente dalla durata dell'audio."""
+    wav = np.asarray(wav, dtype=np.float32)
+    if len(wav) < n_fft:
+        wav = np.pad(wav, (0, n_fft - len(wav)))
+    window = np.hanning(n_fft).astype(np.float32)
+    n_frames = 1 + (len(wav) - n_fft) // hop
+    frames = np.stack([wav[i * hop : i * hop + n_fft] * window for i in range(n_frames)])
+    return np.log1p(np.abs(np.fft.rfft(frames, axis=1))).mean(axis=0)
+
+
+def similarity(reference: np.ndarray, candidate: np.ndarray) -> float:
+    a, b = spectral_profile(reference), spectral_profile(candidate)
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-12))
+
+
+def run(maker: AudioMaker, sentences: list[str], seed: int) -> list[dict]:
+    sample_rate = maker.tts.synthesizer.output_sample_rate
+    results = []
+    for i, sentence in enumerate(sentences):
+        torch.manual_seed(seed + i)
+        start = perf_counter()
+        wav = maker.synthesizer.synthesize_one(sentence)
+        elapsed = perf_counter() - start
+        duration = len(wav) / sample_rate
+        results.append(
+            {"wav": wav, "time": elapsed, "duration": duration, "rtf": elapsed / duration}
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark della modalità CPU del TTS")
+    parser.add_argument("--config", default="./chat/tts/config.yaml")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--quantize",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Confronta fp32 con int8 (default) invece della sola modalità CPU",
+    )
+    parser.add_argument("--output", help="Salva i risultati in JSON")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    # la modalità CPU si applica solo su CPU: anche con CUDA disponibile
+    # entrambe le esecuzioni girano su CPU, altrimenti si confronterebbe fp32 con fp32
+    base = {
+        **config,
+        "device": "cpu",
+        "cache": {"enabled": False},
+        "batching": {"enabled": False},
+    }
+    cpu_config = {
+        **config.get("cpu_mode", {}),
+        "enabled": True,
+        "quantize": args.quantize,
+    }
+
+    print(color("[BENCHMARK]", True, "yellow"), ": Running fp32 baseline", sep="")
+    reference = run(AudioMaker({**base, "cpu_mode": {"enabled": False}}), SENTENCES, args.seed)
+    print(color("[BENCHMARK]", True, "yellow"), ": Running CPU mode", sep="")
+    optimized = run(AudioMaker({**base, "cpu_mode": cpu_config}), SENTENCES, args.seed)
+
+    report = {"cpu_mode": cpu_config, "sentences": []}
+    for sentence, ref, opt in zip(SENTENCES, reference, optimized):
+        report["sentences"].append(
+            {
+                "text": sentence,
+                "fp32_rtf": ref["rtf"],
+                "cpu_rtf": opt["rtf"],
+                "speedup": ref["time"] / opt["time"],
+                "duration_ratio": opt["duration"] / ref["duration"],
+                "similarity": similarity(ref["wav"], opt["wav"]),
+            }
+        )
+    for key in ("fp32_rtf", "cpu_rtf", "speedup", "duration_ratio", "similarity"):
+        report[key] = float(np.mean([s[key] for s in report["sentences"]]))
+
+    for s in report["sentences"]:
+        print(
+            f"{s['text'][:40]:<42} RTF {s['fp32_rtf']:.3f} -> {s['cpu_rtf']:.3f}"
+            f"  x{s['speedup']:.2f}  sim {s['similarity']:.3f}"
+        )
+    print(
+        color("[BENCHMARK]", True, "green"),
+        f": mean RTF {report['fp32_rtf']:.3f} -> {report['cpu_rtf']:.3f}"
+        f" (x{report['speedup']:.2f}), similarity {report['similarity']:.3f}",
+        sep="",
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
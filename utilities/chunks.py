@@ -0,0 +1,47 @@
+import sys
+
+from langchain_core.documents import Document
+
+HEADER = "\\TITLE: {title}\\SOURCE: {source}\\BODY: "
+HEADER_KEYS = ("title", "source")
+
+
+def intern_header(doc: Document) -> Document:
+    """
+    Intern the header fields of a chunk, so chunks of the same file share them.
+
+    Args:
+        doc (Document): The chunk, changed in place
+
+    Returns:
+        Document: The same chunk
+    """
+    for key in HEADER_KEYS:
+        value = doc.metadata.get(key)
+        if isinstance(value, str):
+            doc.metadata[key] = sys.intern(value)
+    return doc
+
+
+def render_chunk(doc: Document) -> str:
+    """
+    Text of a chunk with its title and source header.
+
+    Chunks keep only their body in page_content, and the header is added
+    where it is needed: the embedding input and the prompt. Chunks without a
+    title, and chunks of older databases that already contain the header,
+    are returned as they are.
+
+    Args:
+        doc (Document): The chunk
+
+    Returns:
+        str: The rendered text
+    """
+    content = doc.page_content
+    if "title" not in doc.metadata or content.startswith("\\TITLE: "):
+        return content
+    header = HEADER.format(
+        title=doc.metadata["title"], source=doc.metadata.get("source", "")
+    )
+    return header + content
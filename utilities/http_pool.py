@@ -0,0 +1,95 @@
+import asyncio
+import weakref
+
+import httpx
+
+from utilities.colorize import color
+
+
+class ClientPool:
+    """
+    Shared, keep-alive httpx clients for the TTS pipeline.
+
+    One AsyncClient is kept for each running event loop, so connections are
+    reused across requests instead of being opened for every sentence.
+    Requests use HTTP/1.1: the services are plain-http uvicorn apps, which
+    do not speak HTTP/2.
+    Clients of loops that are no longer running are released on the next
+    get(), since each run of a Streamlit script uses a new loop.
+    """
+
+    def __init__(self, config: dict | None = None):
+        self.config = {}
+        self.clients = weakref.WeakKeyDictionary()
+        self.configure(config or {})
+
+    def configure(self, config: dict):
+        """
+        Set limits and timeouts for the clients created from now on.
+
+        Args:
+            config (dict): The "http" section of a configuration file
+        """
+        self.config = {
+            "max_connections": config.get("max_connections", 20),
+            "max_keepalive_connections": config.get("max_keepalive_connections", 10),
+            "keepalive_expiry": config.get("keepalive_expiry", 30),
+            "timeout": config.get("timeout", 10),
+            "connect_timeout": config.get("connect_timeout", 5),
+        }
+
+    def get(self) -> httpx.AsyncClient:
+        """Return the client bound to the running event loop, creating it if needed."""
+        loop = asyncio.get_running_loop()
+        self._release_stopped(loop)
+        client = self.clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.config["max_connections"],
+                    max_keepalive_connections=self.config["max_keepalive_connections"],
+                    keepalive_expiry=self.config["keepalive_expiry"],
+                ),
+                timeout=httpx.Timeout(
+                    self.config["timeout"], connect=self.config["connect_timeout"]
+                ),
+            )
+            self.clients[loop] = client
+            print(
+                color("[HTTP POOL]", True, "yellow"),
+                ": Client created",
+                sep="",
+            )
+        return client
+
+    async def aclose(self):
+        """Close the client of the running event loop."""
+        loop = asyncio.get_running_loop()
+        client = self.clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+
+    def _release_stopped(self, current: asyncio.AbstractEventLoop):
+        """
+        Drop the clients of loops that stopped or were closed.
+
+        They cannot be awaited from another loop, and their open connections
+        keep the loop referenced, so the weak keys alone never free them.
+        Once released, the transports are collected and their sockets closed.
+        """
+        stopped = [
+            loop
+            for loop in self.clients
+            if loop is not current and (loop.is_closed() or not loop.is_running())
+        ]
+        for loop in stopped:
+            del self.clients[loop]
+        if stopped:
+            print(
+                color("[HTTP POOL]", True, "yellow"),
+                f": Released {len(stopped)} client(s) of stopped event loops",
+                sep="",
+            )
+
+
+client_pool = ClientPool()
@@ -0,0 +1,186 @@
+import bisect
+import threading
+from abc import ABC, abstractmethod
+from time import perf_counter
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RTF_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 4)
+
+
+class Metric(ABC):
+    """Base class for a named metric with an optional set of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.lock = threading.Lock()
+
+    @abstractmethod
+    def samples(self) -> list[tuple[str, str, float]]:
+        """Return (suffix, labels, value) tuples to render."""
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing value, e.g. bytes transferred."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.values: dict[str, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [("", key, value) for key, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    """
+    Value that can go up and down.
+
+    When a function is given, it is called at scrape time instead, so queue
+    sizes can be reported without updating the gauge on every change.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function=None):
+        super().__init__(name, documentation)
+        self.value = 0.0
+        self.function = function
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = float("nan")
+        return [("", "", value)]
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager that observes the elapsed time in seconds."""
+        return _Timer(self)
+
+    def samples(self):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            samples.append(("_bucket", f'{{le="{_format(bound)}"}}', cumulative))
+        cumulative += counts[-1]
+        samples.append(("_bucket", '{le="+Inf"}', cumulative))
+        samples.append(("_sum", "", total))
+        samples.append(("_count", "", cumulative))
+        return samples
+
+
+class Registry:
+    """
+    Minimal metrics registry rendered in the Prometheus text format.
+
+    Metrics are created once by name, so modules can ask for the same metric
+    without sharing references.
+    """
+
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name: str, documentation: str, **kwargs) -> Metric:
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, documentation, **kwargs)
+            return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._get(Counter, name, documentation)
+
+    def gauge(self, name: str, documentation: str, function=None) -> Gauge:
+        gauge = self._get(Gauge, name, documentation)
+        if function is not None:
+            gauge.set_function(function)
+        return gauge
+
+    def histogram(
+        self, name: str, documentation: str, buckets=LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._get(Histogram, name, documentation, buckets=buckets)
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(perf_counter() - self.start)
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+def _format(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+metrics = Registry()
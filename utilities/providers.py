@@ -0,0 +1,241 @@
+import asyncio
+import re
+import time
+import zlib
+from typing import Any, AsyncIterator, Iterator, Optional, Sequence
+
+import numpy as np
+from langchain.retrievers.document_compressors.base import BaseDocumentCompressor
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+_WORD = re.compile(r"\w+")
+_TOKEN = re.compile(r"\S+\s*|\s+")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic local embedder, a stand-in for the remote one in offline runs.
+
+    Each word is hashed to a signed bucket of a fixed-size vector and the
+    result is L2-normalized, so texts sharing words are close. An optional
+    latency is added to every call to mimic a remote service.
+    """
+
+    def __init__(self, dim: int = 1024, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.calls = 0
+
+    def embed(self, text: str) -> list[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in _WORD.findall(text.lower()):
+            h = zlib.crc32(word.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self.embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+class LexicalReranker(BaseDocumentCompressor):
+    """
+    Deterministic local reranker, a stand-in for the remote one in offline runs.
+
+    The relevance score of a document is the fraction of the query words it
+    contains, so it lies in [0, 1] like the scores of the remote reranker.
+    """
+
+    top_n: int = 3
+    latency: float = 0.0
+    calls: int = 0
+
+    @staticmethod
+    def words(text: str) -> set[str]:
+        return {w for w in _WORD.findall(text.lower()) if len(w) > 2}
+
+    def score(self, query: set[str], doc: Document) -> float:
+        if not query:
+            return 0.0
+        return len(query & self.words(doc.page_content)) / len(query)
+
+    def compress_documents(
+        self, documents: Sequence[Document], query: str, callbacks=None
+    ) -> Sequence[Document]:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        words = self.words(query)
+        scored = sorted(
+            ((self.score(words, d), i) for i, d in enumerate(documents)),
+            key=lambda x: (-x[0], x[1]),
+        )
+        return [
+            Document(
+                page_content=documents[i].page_content,
+                metadata={**documents[i].metadata, "relevance_score": score},
+            )
+            for score, i in scored[: self.top_n]
+        ]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Local chat model that answers with canned text, for offline runs.
+
+    The answer is the one of the first rule whose pattern matches the prompt,
+    otherwise the next of the canned responses. It is streamed word by word
+    at `tokens_per_second` (0: all at once) after `latency` seconds.
+    """
+
+    responses: list[str] = ["Risposta di prova."]
+    rules: dict[str, str] = {}
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def answer(self, messages: list[BaseMessage]) -> str:
+        prompt = "\n".join(str(m.content) for m in messages)
+        self.calls += 1
+        for pattern, response in self.rules.items():
+            if re.search(pattern, prompt):
+                return response
+        return self.responses[(self.calls - 1) % len(self.responses)]
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = "".join(c.message.content for c in self._stream(messages))
+        message = AIMessage(content=text)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        text = self.answer(messages)
+        time.sleep(self.latency)
+        for i, token in enumerate(_TOKEN.findall(text)):
+            if i and self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = [c.message.content async for c in self._astream(messages)]
+        message = AIMessage(content="".join(tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        text = self.answer(messages)
+        await asyncio.sleep(self.latency)
+        for i, token in enumerate(_TOKEN.findall(text)):
+            if i and self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def make_embedder(config: dict) -> Embeddings:
+    """
+    Embedder selected by providers.embedder: 'cohere' or 'hashing' (local)
+
+    Args:
+        config (dict): The chatbot configuration
+
+    Returns:
+        Embeddings: The embedder
+    """
+    providers = config.get("providers", {})
+    if providers.get("embedder", "cohere") == "hashing":
+        local = providers["local"]
+        return HashingEmbeddings(local["embedding_dim"], local["embed_latency"])
+    from langchain_cohere import CohereEmbeddings
+
+    return CohereEmbeddings(model=config["embedder"])
+
+
+def make_reranker(config: dict) -> BaseDocumentCompressor:
+    """
+    Reranker selected by providers.reranker: 'cohere' or 'lexical' (local)
+
+    Args:
+        config (dict): The chatbot configuration
+
+    Returns:
+        BaseDocumentCompressor: The reranker
+    """
+    providers = config.get("providers", {})
+    if providers.get("reranker", "cohere") == "lexical":
+        latency = providers["local"]["rerank_latency"]
+        return LexicalReranker(top_n=config["top_n"], latency=latency)
+    from langchain_cohere import CohereRerank
+
+    return CohereRerank(model=config["reranker"], top_n=config["top_n"])
+
+
+def make_chat_model(config: dict) -> BaseChatModel:
+    """
+    Chat model selected by providers.llm: 'ollama' or 'fake' (local)
+
+    Args:
+        config (dict): The chatbot configuration
+
+    Returns:
+        BaseChatModel: The chat model
+    """
+    providers = config.get("providers", {})
+    if providers.get("llm", "ollama") == "fake":
+        local = providers["local"]
+        return FakeChatModel(
+            responses=local["responses"],
+            rules=local.get("rules") or {},
+            latency=local["llm_latency"],
+            tokens_per_second=local["tokens_per_second"],
+        )
+    from langchain_ollama import ChatOllama
+
+    return ChatOllama(
+        model=config["model"]["name"], temperature=config["model"]["temperature"]
+    )
@@ -0,0 +1,113 @@
+import re
+
+ABBREVIATIONS = {
+    "es", "ecc", "etc", "sig", "sigg", "sig.ra", "dott", "dr", "prof", "ing",
+    "avv", "arch", "geom", "gen", "col", "magg", "cap", "ten", "serg", "pag",
+    "pagg", "art", "artt", "cfr", "vol", "n", "nr", "num", "tel", "fig", "p",
+    "pp", "s", "ss", "mr", "mrs", "vs", "ca", "lett",
+}
+
+TERMINATORS = ".!?"
+CLOSERS = "\"')]»*"
+_LAST_WORD = re.compile(r"([\w.]+)$")
+
+
+class SentenceSegmenter:
+    """
+    Incremental sentence splitter for streamed text.
+
+    Only newly appended text is scanned, and each sentence is returned exactly
+    once, as soon as the character after its terminator is known. Dots inside
+    numbers, abbreviations, initials and list markers do not end a sentence.
+    """
+
+    def __init__(self, abbreviations: set[str] = ABBREVIATIONS):
+        self.abbreviations = abbreviations
+        self.buffer = ""
+        self.pos = 0
+
+    def reset(self):
+        self.buffer = ""
+        self.pos = 0
+
+    def feed(self, text: str) -> list[str]:
+        """
+        Append text and return the sentences it completes.
+
+        Args:
+            text (str): New text, e.g. a streamed token
+
+        Returns:
+            list[str]: Completed sentences, already sanitized
+        """
+        self.buffer += text
+        return self._scan(final=False)
+
+    def flush(self) -> list[str]:
+        """
+        Return whatever is left in the buffer as the last sentence.
+
+        Returns:
+            list[str]: Remaining sentences, already sanitized
+        """
+        sentences = self._scan(final=True)
+        last = self.sanitize(self.buffer)
+        if last:
+            sentences.append(last)
+        self.reset()
+        return sentences
+
+    @staticmethod
+    def sanitize(text: str) -> str:
+        text = text.translate({ord(i): None for i in "*#!\t"}).replace("\n", " ")
+        text = text.strip(" -")
+        return text if any(c.isalnum() for c in text) else ""
+
+    def _scan(self, final: bool) -> list[str]:
+        sentences = []
+        buffer = self.buffer
+        start = 0
+        i = self.pos
+        n = len(buffer)
+        while i < n:
+            ch = buffer[i]
+            if ch == "\n":
+                end = i + 1
+            elif ch in TERMINATORS:
+                end = i + 1
+                while end < n and buffer[end] in TERMINATORS:
+                    end += 1
+                while end < n and buffer[end] in CLOSERS:
+                    end += 1
+                if end == n and not final:
+                    break  # serve il carattere successivo per decidere
+                if end < n and not buffer[end].isspace():
+                    i = end
+                    continue
+                if ch == "." and end == i + 1 and self._is_abbreviation(buffer[start:i]):
+                    i = end
+                    continue
+            else:
+                i += 1
+                continue
+            sentence = self.sanitize(buffer[start:end])
+            if sentence:
+                sentences.append(sentence)
+            start = end
+            i = end
+        self.buffer = buffer[start:]
+        self.pos = i - start
+        return sentences
+
+    def _is_abbreviation(self, segment: str) -> bool:
+        match = _LAST_WORD.search(segment)
+        if not match:
+            return False
+        word = match.group(1)
+        if word.lower() in self.abbreviations:
+            return True
+        if len(word) == 1 and word.isalpha() and word.isupper():
+            return True  # iniziali, es. "G. Rossi"
+        if word.isdigit() and segment.strip() == word:
+            return True  # elenco numerato, es. "1. "
+        return False
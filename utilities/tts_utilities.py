@@ -8,12 +8,15 @@ class TextRequest(BaseModel):
     text: str
     id: int
     sub_id: Optional[int] = None
+    request: str = ""
 
 
 class AudioRequest(BaseModel):
-    content: List
+    content: List = []
     id: int
     sub_id: Optional[int] = None
+    request: str = ""
+    error: Optional[str] = None  # sintesi fallita: il buffer ritenta il frammento
 
 
 class MultipleTextRequest(BaseModel):
@@ -27,10 +30,11 @@ class MultipleAudioRequest(BaseModel):
 class AudioFragment:
     """Rappresenta un frammento audio generato dal TTS."""
 
-    def __init__(self, content, id, sub_id=None):
+    def __init__(self, content, id, sub_id=None, request=""):
         self.content = content
         self.id = id
         self.sub_id = sub_id
+        self.request = request
 
     def __repr__(self):
         return f"AudioFragment {self.id} (len={len(self.content)})"
@@ -39,10 +43,11 @@ class AudioFragment:
 class TextFragment:
     """Rappresenta un frammento di testo."""
 
-    def __init__(self, text, id, sub_id=None):
+    def __init__(self, text, id, sub_id=None, request=""):
         self.text = text
         self.id = id
         self.sub_id = sub_id
+        self.request = request
 
     def __repr__(self):
         return f"TextFragment {self.id} (len={len(self.text)})"
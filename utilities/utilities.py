@@ -1,21 +1,25 @@
 import asyncio
-import re
 from time import time
+from uuid import uuid4
 
-import httpx
 import yaml
 from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
 from pydantic import BaseModel
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 
+from chat.tts.audio_store import AudioStore
+from utilities.chunks import render_chunk
 from utilities.colorize import color
+from utilities.http_pool import client_pool
+from utilities.segmenter import SentenceSegmenter
 
 
 class TextRequest(BaseModel):
     text: str
     id: int
     sub_id: int | None = None
+    request: str = ""
 
 
 class MessageWithDocs:
@@ -122,25 +126,33 @@ class StdOutHandler:
     Class to manage token's stream
     """
 
-    def __init__(self, config, audio=True, debug=False):
+    def __init__(self, config, audio=True, debug=False, pipeline=None):
         self.containers = None
         self.text = ""
-        self.chunks = []
-        self.completed_chunks = []
+        self.segmenter = SentenceSegmenter()
+        self.n_chunks = 0  # frasi già inviate al buffer
+        self.session_id = uuid4().hex[:12]
+        self.n_requests = 0
+        self.request = ""
+        self.audio_request = None  # ultima richiesta con audio pronto
+        self.audio_clip = None  # (richiesta, audio, frequenza) già decodificato
         self.time = 0
         self.config = config
         self.debug = debug
         self.audio = audio
+        self.pipeline = pipeline  # EmbeddedPipeline, se il TTS gira in questo processo
 
     def set_audio(self, audio: bool):
         self.audio = audio
 
     def start(self, containers=None):
         self.time = time()
+        self.n_requests += 1
+        self.request = f"{self.session_id}-{self.n_requests}"
         self.text = ""
         self.containers = containers
-        self.chunks = []
-        self.completed_chunks = []
+        self.segmenter.reset()
+        self.n_chunks = 0
 
     async def on_new_token(self, token: dict) -> None:
         token = token.content if isinstance(token, AIMessageChunk) else ""
@@ -151,79 +163,117 @@ class StdOutHandler:
             self.text += token
             if self.audio:
                 try:
-                    await self.generate_audio_stream()
+                    await self.generate_audio_stream(self.segmenter.feed(token))
                 except Exception as e:
                     print(color("[STDOUTHANDLER]", True, "red"), f"Error: {e}")
                     self.error(e)
             if self.containers:
                 self.containers[0].markdown(self.text)
 
-    def sanitize_text(self, text: str) -> str:
-        return text.translate({ord(i): None for i in "*!\n\t"})
-
-    def chunk_text(self, text: str) -> list[str]:
-        stripped_text = self.sanitize_text(text)
-        return [
-            chunk.strip() for chunk in re.split(r"[.]", stripped_text) if chunk.strip()
-        ]
-
-    async def generate_audio_stream(self):
-        if self.text:
-            self.chunks = self.chunk_text(self.text)
-
-        if len(self.chunks) > 1:
-            async with httpx.AsyncClient() as client:
-                for i in range(len(self.chunks) - 1):
-                    if self.chunks[i] and i not in self.completed_chunks:
-                        self.completed_chunks.append(i)
-                        response = await client.post(
-                            "http://localhost:8000/store_text",
-                            json=TextRequest(text=self.chunks[i], id=i).model_dump(),
-                        )
-                        if response.json().get("status", "error") == "error":
-                            self.error(Exception("Errore nell'invio del chunk"))
+    async def generate_audio_stream(self, sentences: list[str]):
+        if not sentences:
+            return
+        if self.pipeline is not None:
+            for sentence in sentences:
+                await self.pipeline.put(
+                    TextRequest(text=sentence, id=self.n_chunks, request=self.request)
+                )
+                self.n_chunks += 1
+            return
+        client = client_pool.get()
+        for sentence in sentences:
+            response = await client.post(
+                "http://localhost:8000/store_text",
+                json=TextRequest(
+                    text=sentence, id=self.n_chunks, request=self.request
+                ).model_dump(),
+            )
+            self.n_chunks += 1
+            if response.json().get("status", "error") == "error":
+                self.error(Exception("Errore nell'invio del chunk"))
 
     async def end(self):
         if self.audio and self.text:
-            self.chunks = self.chunk_text(self.text)
-            if self.chunks:
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        "http://localhost:8000/store_text",
-                        json=TextRequest(
-                            text=self.chunks[-1], id=len(self.chunks) - 1
-                        ).model_dump(),
+            await self.generate_audio_stream(self.segmenter.flush())
+            if self.n_chunks and self.pipeline is not None:
+                if await self.pipeline.finish(self.request):
+                    self.audio_request = self.request
+                self.time = time() - self.time
+                text_time = f"⏱ Tempo di risposta: {self.time:.2f} secondi"
+                if self.debug:
+                    print("\n" + text_time)
+                if self.containers:
+                    self.containers[1].markdown(text_time)
+            elif self.n_chunks:
+                client = client_pool.get()
+                # Controllo finale per il completamento
+                while True:
+                    final_response = await client.get(
+                        "http://localhost:8000/", params={"request": self.request}
                     )
-                    if response.json().get("status", "error") == "error":
-                        self.error(Exception("Errore nell'invio del chunk"))
-
-                    # Controllo finale per il completamento
-                    while True:
-                        final_response = await client.get("http://localhost:8000/")
-                        status = final_response.json().get("status", "error")
-                        if status == "ok":
-                            print("Risposta finale ricevuta")
-                            self.time = time() - self.time
-                            text_time = f"⏱ Tempo di risposta: {self.time:.2f} secondi"
-                            if self.debug:
-                                print("\n" + text_time)
-                            if self.containers:
-                                self.containers[1].markdown(text_time)
-                            break
-                        elif status == "error":
-                            print("Errore nella risposta finale")
-                            self.error(Exception("Errore nella risposta finale"))
-                        else:
-                            print("Risposta finale in elaborazione")
-                            await asyncio.sleep(1)
+                    status = final_response.json().get("status", "error")
+                    if status == "ok":
+                        print("Risposta finale ricevuta")
+                        if final_response.json().get("url"):
+                            self.audio_request = self.request
+                        self.time = time() - self.time
+                        text_time = f"⏱ Tempo di risposta: {self.time:.2f} secondi"
+                        if self.debug:
+                            print("\n" + text_time)
+                        if self.containers:
+                            self.containers[1].markdown(text_time)
+                        break
+                    elif status == "error":
+                        print("Errore nella risposta finale")
+                        self.error(Exception("Errore nella risposta finale"))
+                    else:
+                        print("Risposta finale in elaborazione")
+                        await asyncio.sleep(1)
+        self.text = ""
+        self.segmenter.reset()
+        self.n_chunks = 0
+
+    async def cancel(self):
+        """Annulla l'audio ancora da sintetizzare per le risposte precedenti."""
+        if self.audio and self.pipeline is not None:
+            await self.pipeline.cancel(self.request)
+        elif self.audio:
+            await client_pool.get().post(
+                "http://localhost:8000/cancel", params={"request": self.request}
+            )
+        self.audio_request = None
+        self.audio_clip = None
         self.text = ""
-        self.chunks = []
-        self.completed_chunks = []
+        self.segmenter.reset()
+        self.n_chunks = 0
+
+    async def get_audio(self):
+        """
+        Restituisce l'audio dell'ultima risposta come (array, frequenza).
+
+        La clip compressa viene scaricata dal buffer solo la prima volta, poi
+        resta decodificata in memoria finché non arriva una nuova risposta.
+        """
+        if self.audio_request is None:
+            return None
+        if self.audio_clip is None or self.audio_clip[0] != self.audio_request:
+            if self.pipeline is not None:
+                data = await self.pipeline.get_audio(self.audio_request)
+            else:
+                response = await client_pool.get().get(
+                    f"http://localhost:8000/audio/{self.audio_request}"
+                )
+                data = response.content if response.status_code == 200 else None
+            if data is None:
+                return None
+            audio, fs = AudioStore.decode(data)
+            self.audio_clip = (self.audio_request, audio, fs)
+        return self.audio_clip[1], self.audio_clip[2]
 
     def error(self, error: Exception):
         self.text = ""
-        self.chunks = []
-        self.completed_chunks = []
+        self.segmenter.reset()
+        self.n_chunks = 0
         self.time = time() - self.time
         text_time = f"⏱ Tempo di risposta: {self.time:.2f} secondi"
         if self.debug:
@@ -252,5 +302,5 @@ def load_config(file_path="config.yaml"):
 
 def docs_to_string(docs, sep="\n\n"):
     if docs:
-        return f"{sep}".join([d.page_content for d in docs])
+        return f"{sep}".join([render_chunk(d) for d in docs])
     return ""
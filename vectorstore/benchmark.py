@@ -0,0 +1,181 @@
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import faiss
+from langchain_community.docstore import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from utilities.providers import HashingEmbeddings
+from vectorstore.data_manager import Data
+from vectorstore.db_maker import DBMaker
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ("load", "split", "embed", "add", "save")
+
+
+def peak_memory() -> dict[str, int | None]:
+    """
+    Peak resident memory of this process and of its finished children
+
+    Returns:
+        dict[str, int | None]: Bytes, None where it cannot be measured
+    """
+    if resource is None:
+        return {"self": None, "children": None}
+    scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is in KB on Linux
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+def dir_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(path)
+        for name in files
+    )
+
+
+def run_benchmark(config: dict, data: list[Data]) -> dict:
+    """
+    Build the database from scratch with a local embedder and measure it.
+
+    The build runs in a temporary directory, without the embedding cache,
+    the rate limit or incremental updates, so results depend only on the
+    data and on the code; the database in paths.db is not touched. The
+    embeddings have hashing_dim dimensions, as in the local build.
+
+    Args:
+        config (dict): The vectorstore configuration
+        data (list[Data]): List of data
+
+    Returns:
+        dict: The report, see print_report()
+    """
+    config = copy.deepcopy(config)
+    db_dir = tempfile.mkdtemp(prefix="vectorstore-benchmark-")
+    config["paths"]["db"] = db_dir
+    config["ingestion"]["incremental"] = False
+    config["embedding"]["requests_per_minute"] = 0
+    config["embedding"]["cache"]["enabled"] = False
+    dim = config["hashing_dim"]
+
+    embedder = HashingEmbeddings(dim)
+    vectorstore = FAISS(
+        embedding_function=embedder,
+        index=faiss.IndexFlatL2(dim),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+    db_maker = DBMaker(config, vectorstore)
+    start = time.perf_counter()
+    try:
+        db_maker.make(data)
+        wall = time.perf_counter() - start
+        index = db_maker.vectorstore.index
+        chunks = index.ntotal
+        disk = {
+            name: (
+                dir_size(os.path.join(db_dir, name))
+                if os.path.isdir(os.path.join(db_dir, name))
+                else os.path.getsize(os.path.join(db_dir, name))
+            )
+            for name in sorted(os.listdir(db_dir))
+        }
+        docstore = db_maker.vectorstore.docstore
+        text_bytes = sum(
+            len(docstore.search(doc_id).page_content.encode("utf-8"))
+            for doc_id in db_maker.vectorstore.index_to_docstore_id.values()
+        )
+        ram = {
+            "index": int(faiss.serialize_index(index).nbytes),
+            "docstore_text": text_bytes,
+        }
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+    timings = db_maker.timings()
+    tokens = db_maker.embedding.tokens
+    files = db_maker.n_files
+    return {
+        "files": files,
+        "chunks": chunks,
+        "tokens": tokens,
+        "embed_calls": embedder.calls,
+        "wall_seconds": wall,
+        "throughput": {
+            "files_per_second": files / wall if wall else 0.0,
+            "chunks_per_second": chunks / wall if wall else 0.0,
+            "tokens_per_second": tokens / wall if wall else 0.0,
+        },
+        "stages": {
+            stage: {
+                "seconds": timings.get(stage, 0.0),
+                "chunks_per_second": (
+                    chunks / timings[stage] if timings.get(stage) else None
+                ),
+            }
+            for stage in STAGES
+        },
+        "peak_memory_bytes": peak_memory(),
+        "disk_bytes": disk,
+        "ram_bytes": ram,
+        "config": {
+            "workers": config["ingestion"]["workers"],
+            "dedup": config["ingestion"]["dedup"]["enabled"],
+            "compact_docstore": config["docstore"]["compact"],
+            "dim": dim,
+        },
+    }
+
+
+def _size(n: int | None) -> str:
+    if n is None:
+        return "n/d"
+    return f"{n / 2**10:.1f} KB" if n < 2**20 else f"{n / 2**20:.1f} MB"
+
+
+def print_report(report: dict):
+    throughput = report["throughput"]
+    print(
+        f"\33[1;34m[Benchmark]\33[0m: {report['files']} file, {report['chunks']}"
+        f" chunks, {report['tokens']} token stimati in {report['wall_seconds']:.2f}s"
+    )
+    print(
+        f"\33[1;34m[Benchmark]\33[0m: {throughput['files_per_second']:.1f} file/s,"
+        f" {throughput['chunks_per_second']:.1f} chunks/s,"
+        f" {throughput['tokens_per_second']:.0f} token/s"
+    )
+    for stage, stats in report["stages"].items():
+        rate = stats["chunks_per_second"]
+        print(
+            f"\33[1;34m[Benchmark]\33[0m: {stage:<6} {stats['seconds']:8.3f}s"
+            + (f"  {rate:10.1f} chunks/s" if rate else "")
+        )
+    memory = report["peak_memory_bytes"]
+    print(
+        f"\33[1;34m[Benchmark]\33[0m: Picco di memoria {_size(memory['self'])}"
+        f" (processi figli {_size(memory['children'])})"
+    )
+    disk = ", ".join(f"{name} {_size(n)}" for name, n in report["disk_bytes"].items())
+    print(f"\33[1;34m[Benchmark]\33[0m: Su disco: {disk}")
+    ram = report["ram_bytes"]
+    print(
+        f"\33[1;34m[Benchmark]\33[0m: In memoria: indice {_size(ram['index'])},"
+        f" testi {_size(ram['docstore_text'])}"
+    )
+
+
+def save_report(report: dict, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
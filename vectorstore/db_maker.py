@@ -1,48 +1,462 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
 from langchain_community.vectorstores import FAISS
 from tqdm import tqdm
 
+from utilities.chunks import intern_header
 from vectorstore.data_manager import Data
+from vectorstore.dedup import NearDuplicateFilter
+from vectorstore.docstore import BUILD_FILE, export_docstore, write_build
+from vectorstore.embedding import EmbeddingPipeline
+from vectorstore.embedding_cache import EmbeddingCache
+from vectorstore.manifest import Manifest
+from vectorstore.sharding import shard_dir, shard_of
 from vectorstore.splitter import Splitter
 
 
 class DBMaker:
     """
     Create the database containing the vectors of the data.
+
+    With sharding.shards greater than 1, each shard is built by its own
+    DBMaker from the files whose path hashes to it, and is saved with its
+    manifest and checkpoint in a separate directory.
     """
 
-    def __init__(self, config: dict, vectorstore: FAISS):
+    def __init__(self, config: dict, vectorstore: FAISS, shard: int | None = None):
         self.config = config
         self.vectorstore = vectorstore
+        self.shard = shard
+        self.db_dir = config["paths"]["db"]
+        if shard is not None:
+            self.db_dir = shard_dir(self.db_dir, shard)
+            os.makedirs(self.db_dir, exist_ok=True)
+        self.checkpoint_dir = os.path.join(self.db_dir, "checkpoint")
+        self.manifest = Manifest(os.path.join(self.db_dir, "manifest.json"))
+        embedding = config["embedding"]
+        self.cache = None
+        if embedding["cache"]["enabled"]:
+            self.cache = EmbeddingCache(embedding["cache"]["dir"], config["embedder"])
+        self.embedding = EmbeddingPipeline(
+            vectorstore.embeddings,
+            embedding["concurrency"],
+            embedding["requests_per_minute"],
+            embedding["max_items"],
+            embedding["max_tokens"],
+            embedding["retries"],
+            embedding["backoff"],
+            self.cache,
+        )
+        self.dedup = None
+        # Files streamed by this run whose duplicates are not merged yet:
+        # (path, chunks streamed up to its end, [(kept chunk id, source)])
+        self.pending: list[tuple[str, int, list[tuple[str, str]]]] = []
+        self.streamed = 0
+        self.splitter = None
+        self.n_files = 0  # files split by the last build
+        self.save_seconds = 0.0
         print("\33[1;34m[DBMaker]\33[0m: Maker del database inizializzato")
 
+    def tasks(self, splitter: Splitter, data: list[Data]) -> list[tuple[Data, str]]:
+        """
+        Files to build, only those of the shard if the database is sharded
+
+        Args:
+            splitter (Splitter): The splitter
+            data (list[Data]): List of data
+
+        Returns:
+            list[tuple[Data, str]]: The data and the path of each file
+        """
+        tasks = list(splitter.tasks(data))
+        if self.shard is None:
+            return tasks
+        shards = self.config["sharding"]["shards"]
+        return [(d, path) for d, path in tasks if shard_of(path, shards) == self.shard]
+
+    def reset_dedup(self):
+        dedup = self.config["ingestion"]["dedup"]
+        self.dedup = None
+        self.pending = []
+        self.streamed = 0
+        if dedup["enabled"]:
+            self.dedup = NearDuplicateFilter(
+                dedup["threshold"], dedup["num_perm"], dedup["bands"], dedup["shingle"]
+            )
+
+    def seed_dedup(self):
+        """
+        Add the chunks already in the index to the near-duplicate filter, so
+        the chunks of new and modified files are checked against them too
+        """
+        if self.dedup is None:
+            return
+        docstore = self.vectorstore.docstore
+        for doc_id in self.vectorstore.index_to_docstore_id.values():
+            doc = docstore.search(doc_id)
+            if isinstance(doc, str):
+                continue  # Chunk not in the docstore
+            doc.id = doc_id
+            self.dedup.add(doc)
+
     def make(self, data: list[Data]):
         """
         Create the database.
+
+        Chunks are streamed through load -> split -> batch -> embed -> add, so
+        only the batches in flight are kept in memory. Batches are embedded
+        concurrently and added in order, see EmbeddingPipeline. Every few
+        batches the partial index is saved as a checkpoint, together with the
+        manifest of the files whose chunks are all in it: if the build is
+        interrupted, the next run with the same data resumes from those files
+        like an incremental update, so files edited in the meantime are split
+        again. Near-duplicate chunks are collapsed into the first one, which
+        lists all their sources in metadata["sources"].
+        With ingestion.incremental set and an existing database, only the
+        files that changed since the last build are processed, see update().
+        """
+        ingestion = self.config["ingestion"]
+        splitter = Splitter(self.config["paths"]["data"], ingestion["workers"])
+        fingerprint = self.fingerprint(data)
+        if self.resume(fingerprint) or (
+            ingestion.get("incremental", False) and self.load_existing()
+        ):
+            return self.update(data, splitter, fingerprint)
+
+        self.manifest = Manifest(self.manifest.path)
+        self.reset_dedup()
+        tasks = self.tasks(splitter, data)
+        self.splitter, self.n_files = splitter, len(tasks)
+        self.add(self.stream(splitter, tasks), fingerprint)
+
+    def update(self, data: list[Data], splitter: Splitter, fingerprint: str):
+        """
+        Update the existing database with the files that changed.
+
+        Chunks of deleted and modified files are removed from the index, then
+        only new and modified files are split, embedded and added, checked for
+        near-duplicates against the chunks that stay in the index. Files with
+        chunks collapsed into a removed chunk are processed again as well, and
+        removed or modified files are dropped from the sources of the chunks
+        their own near-duplicates were collapsed into. Checkpoints are saved as
+        in make().
+
+        Args:
+            data (list[Data]): List of data
+            splitter (Splitter): The splitter for the new files
+            fingerprint (str): Fingerprint of the data, for the checkpoints
+        """
+        tasks = self.tasks(splitter, data)
+        current = {path for _, path in tasks}
+        changed = [(d, path) for d, path in tasks if self.manifest.changed(path, d)]
+        removed = [path for path in self.manifest.files if path not in current]
+        stale = removed + [path for _, path in changed]
+        stale_ids = {i for path in stale for i in self.manifest.ids(path)}
+        while True:
+            # Files whose near-duplicates were collapsed into a removed chunk
+            orphans = [
+                (d, path)
+                for d, path in tasks
+                if path not in stale
+                and stale_ids.intersection(
+                    self.manifest.files[path].get("duplicates_of", [])
+                )
+            ]
+            if not orphans:
+                break
+            changed += orphans
+            stale += [path for _, path in orphans]
+            stale_ids.update(i for _, path in orphans for i in self.manifest.ids(path))
+        print(
+            f"\33[1;34m[DBMaker]\33[0m: Aggiornamento incrementale: {len(changed)} file"
+            f" nuovi o modificati, {len(removed)} eliminati"
+        )
+        if stale_ids:
+            self.vectorstore.delete(list(stale_ids))
+        self.drop_sources(stale, stale_ids)
+        for path in stale:
+            # Recorded again once their chunks are streamed
+            self.manifest.remove(path)
+
+        self.reset_dedup()
+        self.seed_dedup()
+        self.splitter, self.n_files = splitter, len(changed)
+        self.add(self.stream(splitter, changed), fingerprint)
+
+    def add(self, chunks, fingerprint: str):
+        """
+        Embed and add the chunks, saving a checkpoint every few batches, then
+        save the database
+
+        Args:
+            chunks (Iterable[Document]): Chunks from stream()
+            fingerprint (str): Fingerprint of the data, for the checkpoints
+        """
+        added = 0
+        batches = self.embedding.add(self.vectorstore, chunks)
+        for i, batch in enumerate(tqdm(batches, desc="Caricamento documenti..."), 1):
+            added += len(batch)
+            if i % self.config["ingestion"]["checkpoint_every"] == 0:
+                self.save_checkpoint(fingerprint, added)
+
+        self.merge_sources()
+        if self.dedup is not None:
+            print(
+                f"\33[1;34m[DBMaker]\33[0m: Rimossi {self.dedup.removed} chunks"
+                " quasi duplicati"
+            )
+        self.save()
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        self.print_cache_stats()
+
+    def timings(self) -> dict[str, float]:
+        """
+        Seconds spent in each stage of the last build. Load and split are
+        summed over the worker processes and embed over the concurrent calls,
+        so with more than one worker they can exceed the wall time.
+        """
+        timings = dict(self.splitter.timings) if self.splitter else {}
+        timings.update(self.embedding.timings)
+        timings["save"] = self.save_seconds
+        return timings
+
+    def print_cache_stats(self):
+        if self.cache is None:
+            return
+        stats = self.cache.stats()
+        print(
+            f"\33[1;34m[DBMaker]\33[0m: Cache degli embedding: {stats['hits']} hit,"
+            f" {stats['misses']} miss ({stats['hit_rate']:.0%})"
+        )
+
+    def stream(self, splitter: Splitter, tasks: list[tuple[Data, str]]):
+        """
+        Split the files and record their chunks in the manifest
+
+        Args:
+            splitter (Splitter): The splitter
+            tasks (list[tuple[Data, str]]): Files to split
+
+        Yields:
+            Document: Chunks with a unique metadata id and a stable id derived
+            from the file content, also in metadata["chunk_id"] together with
+            the position in the file, near-duplicates excluded
+        """
+        for (d, path), chunks in zip(tasks, splitter.split_files(tasks)):
+            # Hashed by the splitter from the bytes it read, see Splitter.hashes
+            self.manifest.hashes[path] = splitter.hashes.pop(path)
+            key = path + self.manifest.hash(path, d)
+            prefix = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+            ids = []
+            duplicates = []
+            for i, chunk in enumerate(chunks):
+                chunk.id = f"{prefix}-{i}"
+                intern_header(chunk)
+                source = chunk.metadata.get("source", path)
+                original = self.dedup.check(chunk) if self.dedup else None
+                if original is not None:
+                    duplicates.append((original, source))
+                    continue
+                chunk.metadata["id"] = self.manifest.next_id
+                chunk.metadata["chunk_id"] = chunk.id
+                chunk.metadata["seq"] = i
+                chunk.metadata["sources"] = [source]
+                self.manifest.next_id += 1
+                ids.append(chunk.id)
+                self.streamed += 1
+                yield chunk
+            self.manifest.set(path, d, ids, [original for original, _ in duplicates])
+            self.pending.append((path, self.streamed, duplicates))
+
+    def merge_sources(self, added: int | None = None) -> set[str]:
+        """
+        Add the sources of the collapsed near-duplicates to the kept chunks
+
+        Args:
+            added (int | None): Chunks added to the index by this run, to merge
+                only the files whose chunks are all in it. None merges all
+
+        Returns:
+            set[str]: Streamed files with chunks not yet in the index
+        """
+        pending = []
+        for path, end, duplicates in self.pending:
+            if added is not None and end > added:
+                pending.append((path, end, duplicates))
+                continue
+            for doc_id, source in duplicates:
+                # The kept chunk comes from this file or an earlier one
+                doc = self.vectorstore.docstore.search(doc_id)
+                if isinstance(doc, str):
+                    continue  # Kept chunk not in the docstore
+                doc.metadata["sources"] = list(
+                    dict.fromkeys(doc.metadata.get("sources", []) + [source])
+                )
+        self.pending = pending
+        return {path for path, _, _ in pending}
+
+    def drop_sources(self, paths: list[str], stale_ids: set[str]):
+        """
+        Remove files from the sources of the kept chunks their near-duplicates
+        were collapsed into, when those chunks stay in the index
+
+        Args:
+            paths (list[str]): Removed and modified files
+            stale_ids (set[str]): Ids of the chunks removed from the index
+        """
+        for path in paths:
+            for doc_id in self.manifest.files.get(path, {}).get("duplicates_of", []):
+                if doc_id in stale_ids:
+                    continue
+                doc = self.vectorstore.docstore.search(doc_id)
+                if isinstance(doc, str):
+                    continue  # Kept chunk not in the docstore
+                sources = doc.metadata.get("sources", [])
+                doc.metadata["sources"] = [s for s in sources if s != path]
+
+    def load_existing(self) -> bool:
+        """
+        Load the database of the last build together with its manifest
+
+        Returns:
+            bool: True if both exist and are consistent
+        """
+        if not os.path.exists(os.path.join(self.db_dir, "index.faiss")):
+            return False
+        if not self.manifest.load():
+            return False
+        vectorstore = FAISS.load_local(
+            self.db_dir,
+            embeddings=self.vectorstore.embeddings,
+            allow_dangerous_deserialization=True,
+        )
+        if vectorstore.index.ntotal != self.manifest.n_chunks():
+            print(
+                "\33[1;33m[DBMaker]\33[0m: Manifest non allineato al database,"
+                " ricostruzione da zero"
+            )
+            return False
+        self.vectorstore = vectorstore
+        return True
+
+    def save(self):
+        """
+        Save index, compact docstore and manifest, replacing the previous files
+        only once the new ones are complete. The manifest is replaced last, and
+        is checked against the index when loaded. The compact docstore is
+        loaded only if it carries the build token written next to the index,
+        which is replaced first, and is deleted when docstore.compact is off.
+        """
+        start = time.perf_counter()
+        tmp_dir = os.path.join(self.db_dir, "tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.vectorstore.save_local(tmp_dir)
+        build = write_build(tmp_dir)
+        if self.config["docstore"]["compact"]:
+            export_docstore(self.vectorstore, os.path.join(tmp_dir, "docstore"), build)
+        else:
+            shutil.rmtree(os.path.join(self.db_dir, "docstore"), ignore_errors=True)
+        self.manifest.save(os.path.join(tmp_dir, "manifest.json"))
+        names = (BUILD_FILE, "index.faiss", "index.pkl", "docstore", "manifest.json")
+        for name in names:
+            src = os.path.join(tmp_dir, name)
+            if not os.path.exists(src):
+                continue
+            if os.path.isdir(src):
+                shutil.rmtree(os.path.join(self.db_dir, name), ignore_errors=True)
+            os.replace(src, os.path.join(self.db_dir, name))
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.save_seconds = time.perf_counter() - start
+
+    @staticmethod
+    def fingerprint(data: list[Data]) -> str:
+        """
+        Identify the data of a build, to resume only a build of the same data
+
+        Args:
+            data (list[Data]): List of data
+
+        Returns:
+            str: Hash of paths, types and split parameters
+        """
+        raw = json.dumps(
+            [
+                [d.path, d.data_type.name, d.chunk_size, d.chunk_overlap]
+                for d in data
+            ]
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def resume(self, fingerprint: str) -> int:
+        """
+        Load the checkpoint of an interrupted build, if any
+
+        The chunks of the files that were not complete are removed, so the
+        build continues as an update of the checkpoint, see update().
+
+        Args:
+            fingerprint (str): Fingerprint of the data being built
+
+        Returns:
+            bool: True if a checkpoint was loaded
+        """
+        state_path = os.path.join(self.checkpoint_dir, "state.json")
+        if not os.path.exists(state_path):
+            return False
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("fingerprint") != fingerprint:
+            print(
+                "\33[1;33m[DBMaker]\33[0m: Checkpoint di dati diversi, ricostruzione da zero"
+            )
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+            return False
+        self.vectorstore = FAISS.load_local(
+            self.checkpoint_dir,
+            embeddings=self.vectorstore.embeddings,
+            allow_dangerous_deserialization=True,
+        )
+        manifest = Manifest(os.path.join(self.checkpoint_dir, "manifest.json"))
+        manifest.load()
+        manifest.path = self.manifest.path
+        self.manifest = manifest
+        complete = {i for path in manifest.files for i in manifest.ids(path)}
+        ids = self.vectorstore.index_to_docstore_id.values()
+        partial = [i for i in ids if i not in complete]
+        if partial:
+            self.vectorstore.delete(partial)
+        print(
+            f"\33[1;34m[DBMaker]\33[0m: Ripresa dal checkpoint ({len(manifest.files)}"
+            f" file, {self.vectorstore.index.ntotal} chunks)"
+        )
+        return True
+
+    def save_checkpoint(self, fingerprint: str, added: int):
+        """
+        Save the partial index, the manifest of the files whose chunks are all
+        in it and the build state
+
+        Args:
+            fingerprint (str): Fingerprint of the data being built
+            added (int): Number of chunks added to the index by this run
         """
-        splitter = Splitter(self.config["paths"]["data"])
-        docs = splitter.create_chunks(data)
-        batches = self.batch(docs)
-        for batch in tqdm(batches, desc="Caricamento documenti..."):
-            self.vectorstore.add_documents(batch)
-        self.vectorstore.save_local(self.config["paths"]["db"])
-
-    def batch(self, chunks, n_max=10000):
-        batches = []
-        current_batch = []
-        count = 0
-
-        for c in chunks:
-            chunk_length = len(c.page_content)
-
-            if count + chunk_length >= n_max:
-                batches.append(current_batch)
-                current_batch = [c]
-                count = chunk_length
-            else:
-                current_batch.append(c)
-                count += chunk_length
-
-        if current_batch:
-            batches.append(current_batch)
-
-        return batches
+        incomplete = self.merge_sources(added)
+        tmp_dir = self.checkpoint_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.vectorstore.save_local(tmp_dir)
+        manifest = Manifest(os.path.join(tmp_dir, "manifest.json"))
+        manifest.files = {
+            path: entry
+            for path, entry in self.manifest.files.items()
+            if path not in incomplete
+        }
+        manifest.next_id = self.manifest.next_id
+        manifest.save()
+        with open(os.path.join(tmp_dir, "state.json"), "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fingerprint}, f)
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        os.replace(tmp_dir, self.checkpoint_dir)
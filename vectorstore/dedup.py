@@ -0,0 +1,102 @@
+import re
+import zlib
+
+import numpy as np
+from langchain_core.documents import Document
+
+_PRIME = np.uint64(4294967311)  # first prime above 2**32
+_WORD = re.compile(r"\w+")
+
+
+class NearDuplicateFilter:
+    """
+    Streaming near-duplicate detection with MinHash and LSH.
+
+    Each chunk body is reduced to a MinHash signature over its word shingles.
+    Signatures are split into bands and indexed by band, so only chunks that
+    share at least one band are compared; a chunk whose estimated Jaccard
+    similarity with an earlier kept chunk reaches the threshold is reported
+    as a duplicate of it.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        num_perm: int = 128,
+        bands: int = 16,
+        shingle: int = 5,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm deve essere un multiplo di bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle = shingle
+        rng = np.random.default_rng(0)  # Fixed permutations, so results are repeatable
+        self.a = rng.integers(1, 2**32, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 2**32, num_perm, dtype=np.uint64)
+        self.buckets: dict[tuple[int, bytes], list[int]] = {}
+        self.signatures: list[np.ndarray] = []
+        self.ids: list[str] = []
+        self.removed = 0
+
+    @staticmethod
+    def body(doc: Document) -> str:
+        """Text to compare, without the header of chunks built with it."""
+        content = doc.page_content
+        marker = content.find("\\BODY: ")
+        return content[marker + len("\\BODY: ") :] if marker >= 0 else content
+
+    def signature(self, text: str) -> np.ndarray:
+        words = _WORD.findall(text.lower())
+        n = max(len(words) - self.shingle + 1, 1)
+        shingles = {" ".join(words[i : i + self.shingle]) for i in range(n)}
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64
+        )
+        permuted = (np.outer(hashes, self.a) + self.b) % _PRIME
+        return permuted.min(axis=0)
+
+    def check(self, doc: Document) -> str | None:
+        """
+        Check a chunk against the chunks kept so far, and keep it if it is new
+
+        Args:
+            doc (Document): The chunk, with its docstore id set
+
+        Returns:
+            str | None: Id of the kept chunk it duplicates, or None if it is new
+        """
+        signature = self.signature(self.body(doc))
+        keys = self._keys(signature)
+        candidates = {i for key in keys for i in self.buckets.get(key, ())}
+        for i in sorted(candidates):
+            if np.mean(self.signatures[i] == signature) >= self.threshold:
+                self.removed += 1
+                return self.ids[i]
+        self._keep(doc.id, signature, keys)
+        return None
+
+    def add(self, doc: Document):
+        """
+        Keep a chunk without checking it, e.g. one already in the index
+
+        Args:
+            doc (Document): The chunk, with its docstore id set
+        """
+        signature = self.signature(self.body(doc))
+        self._keep(doc.id, signature, self._keys(signature))
+
+    def _keys(self, signature: np.ndarray) -> list[tuple[int, bytes]]:
+        return [
+            (band, signature[band * self.rows : (band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def _keep(self, doc_id: str, signature: np.ndarray, keys: list[tuple[int, bytes]]):
+        index = len(self.ids)
+        self.signatures.append(signature)
+        self.ids.append(doc_id)
+        for key in keys:
+            self.buckets.setdefault(key, []).append(index)
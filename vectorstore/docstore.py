@@ -0,0 +1,241 @@
+import json
+import mmap
+import os
+import shutil
+import uuid
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+_MISSING = -1
+BUILD_FILE = "build.json"  # token of the last save, next to the index
+
+
+class MmapDocstore(Docstore):
+    """
+    Read-only docstore backed by memory-mapped files.
+
+    Chunk texts are stored in one contiguous UTF-8 blob with an offsets
+    array, metadata in one column per key: numbers as arrays, strings and
+    other values as codes into a table of distinct values. Rows follow the
+    order of the vectors in the index. Nothing is unpickled on load, and
+    Document objects are created only for the chunks that are returned.
+    The build token of the save that wrote it is kept in meta.json.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.n = meta["n"]
+        self.build = meta.get("build")
+        self.ids: list[str] = meta["ids"]
+        self.rows = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        self._file = open(os.path.join(directory, "text.bin"), "rb")
+        self.text = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.offsets[-1]
+            else b""
+        )
+        self.columns = {}
+        for name, kind in meta["columns"].items():
+            values = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            table = meta["tables"].get(name)
+            self.columns[name] = (kind, values, table)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def index_to_docstore_id(self) -> dict[int, str]:
+        return dict(enumerate(self.ids))
+
+    def search(self, search: str) -> str | Document:
+        """
+        Return the chunk with the given id
+
+        Args:
+            search (str): Id of the chunk
+
+        Returns:
+            str | Document: The chunk, or an error message if it does not exist
+        """
+        row = self.rows.get(search)
+        if row is None:
+            return f"ID {search} not found."
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        metadata = {}
+        for name, (kind, values, table) in self.columns.items():
+            value = values[row]
+            if kind == "table":
+                if value != _MISSING:
+                    metadata[name] = json.loads(table[value])
+            elif kind == "int":
+                if value != np.iinfo(np.int64).min:
+                    metadata[name] = int(value)
+            elif not np.isnan(value):
+                metadata[name] = float(value)
+        return Document(
+            page_content=self.text[start:end].decode("utf-8"),
+            metadata=metadata,
+            id=search,
+        )
+
+    def close(self):
+        if isinstance(self.text, mmap.mmap):
+            self.text.close()
+        self._file.close()
+
+    @staticmethod
+    def write(directory: str, ids: list[str], docs: list[Document], build: str = ""):
+        """
+        Write documents in the compact format
+
+        Args:
+            directory (str): Destination directory, replaced if it exists
+            ids (list[str]): Id of each document, in index order
+            docs (list[Document]): The documents
+            build (str): Token of the save the documents belong to
+        """
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        offsets = [0]
+        with open(os.path.join(directory, "text.bin"), "wb") as f:
+            for doc in docs:
+                data = doc.page_content.encode("utf-8")
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        np.save(
+            os.path.join(directory, "offsets.npy"), np.array(offsets, dtype=np.int64)
+        )
+
+        names = sorted({name for doc in docs for name in doc.metadata})
+        columns, tables = {}, {}
+        for name in names:
+            values = [doc.metadata.get(name) for doc in docs]
+            present = [v for v in values if v is not None]
+            if all(isinstance(v, int) and not isinstance(v, bool) for v in present):
+                kind = "int"
+                array = np.array(
+                    [np.iinfo(np.int64).min if v is None else v for v in values],
+                    dtype=np.int64,
+                )
+            elif all(isinstance(v, float) for v in present):
+                kind = "float"
+                array = np.array(
+                    [np.nan if v is None else v for v in values], dtype=np.float64
+                )
+            else:
+                # Strings, lists and the like: codes into the table of distinct values
+                kind = "table"
+                encoded = [
+                    None if v is None else json.dumps(v, ensure_ascii=False)
+                    for v in values
+                ]
+                codes = {}
+                array = np.array(
+                    [
+                        _MISSING if v is None else codes.setdefault(v, len(codes))
+                        for v in encoded
+                    ],
+                    dtype=np.int32,
+                )
+                tables[name] = list(codes)
+            columns[name] = kind
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "n": len(docs),
+                    "build": build,
+                    "ids": ids,
+                    "columns": columns,
+                    "tables": tables,
+                },
+                f,
+                ensure_ascii=False,
+            )
+
+
+def export_docstore(vectorstore: FAISS, directory: str, build: str = ""):
+    """
+    Write the docstore of a vectorstore in the compact format, in index order
+
+    Args:
+        vectorstore (FAISS): The vectorstore
+        directory (str): Destination directory
+        build (str): Token of the save, see write_build()
+    """
+    ids = [vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)]
+    docs = [vectorstore.docstore.search(doc_id) for doc_id in ids]
+    MmapDocstore.write(directory, ids, docs, build)
+
+
+def write_build(directory: str) -> str:
+    """
+    Write a new build token next to the index
+
+    Args:
+        directory (str): Directory the index is saved to
+
+    Returns:
+        str: The token, to be written in the compact docstore too
+    """
+    build = uuid.uuid4().hex
+    with open(os.path.join(directory, BUILD_FILE), "w", encoding="utf-8") as f:
+        json.dump({"build": build}, f)
+    return build
+
+
+def read_build(directory: str) -> str | None:
+    """
+    Read the build token written next to the index
+
+    Args:
+        directory (str): Directory of the index
+
+    Returns:
+        str | None: The token, or None for a database saved without one
+    """
+    path = os.path.join(directory, BUILD_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["build"]
+
+
+def load_compact(db_dir: str, embeddings: Embeddings) -> FAISS | None:
+    """
+    Load a vectorstore with the compact docstore, without unpickling
+
+    Args:
+        db_dir (str): Directory of the database
+        embeddings (Embeddings): The embedder
+
+    Returns:
+        FAISS | None: The vectorstore, or None if there is no compact docstore
+            written by the same save as the index
+    """
+    directory = os.path.join(db_dir, "docstore")
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        return None
+    build = read_build(db_dir)
+    docstore = MmapDocstore(directory)
+    if build is None or docstore.build != build:
+        docstore.close()
+        return None
+    index = faiss.read_index(os.path.join(db_dir, "index.faiss"))
+    if len(docstore) != index.ntotal:
+        docstore.close()
+        return None
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=docstore.index_to_docstore_id(),
+    )
@@ -0,0 +1,187 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from utilities.chunks import render_chunk
+from vectorstore.embedding_cache import EmbeddingCache
+
+
+class RateLimiter:
+    """
+    Spread calls evenly so that at most `per_minute` start in any minute.
+    """
+
+    def __init__(self, per_minute: float = 0):
+        self.interval = 60 / per_minute if per_minute > 0 else 0
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_call)
+            self.next_call = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class EmbeddingPipeline:
+    """
+    Embed chunks with several concurrent requests and add them to the index.
+
+    Batches are sized by an estimate of their tokens and by the maximum
+    number of texts per call. Up to `concurrency` calls are in flight at the
+    same time, within the rate limit, and failed calls are retried with
+    exponential backoff. Vectors are added to the index in the same order as
+    the chunks, so ids and checkpoints do not depend on the network.
+    Chunks are embedded with their title and source header, but stored
+    without it.
+    """
+
+    def __init__(
+        self,
+        embedder: Embeddings,
+        concurrency: int = 4,
+        requests_per_minute: float = 0,
+        max_items: int = 96,
+        max_tokens: int = 8000,
+        retries: int = 5,
+        backoff: float = 1.0,
+        cache: EmbeddingCache | None = None,
+    ):
+        self.embedder = embedder
+        self.cache = cache
+        self.concurrency = max(concurrency, 1)
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.retries = retries
+        self.backoff = backoff
+        self.timings = {"embed": 0.0, "add": 0.0}  # seconds, embed summed over threads
+        self.tokens = 0  # estimated tokens of the embedded texts
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        """Estimate the tokens of a text, about four characters per token."""
+        return len(text) // 4 + 1
+
+    def batch(self, chunks):
+        """
+        Group chunks into batches within the token and item limits
+
+        Args:
+            chunks (Iterable[Document]): Chunks to group
+
+        Yields:
+            list[Document]: A batch of chunks
+        """
+        current_batch = []
+        count = 0
+
+        for c in chunks:
+            tokens = self.count_tokens(render_chunk(c))
+            if current_batch and (
+                count + tokens > self.max_tokens or len(current_batch) >= self.max_items
+            ):
+                yield current_batch
+                current_batch = []
+                count = 0
+            current_batch.append(c)
+            count += tokens
+
+        if current_batch:
+            yield current_batch
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed a batch of texts, calling the embedder only for those that are
+        not in the cache
+
+        Args:
+            texts (list[str]): Texts to embed
+
+        Returns:
+            list[list[float]]: One vector per text
+        """
+        if self.cache is None:
+            return self.request(texts)
+        vectors = self.cache.get(texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            embedded = self.request([texts[i] for i in missing])
+            self.cache.put([texts[i] for i in missing], embedded)
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        return vectors
+
+    def request(self, texts: list[str]) -> list[list[float]]:
+        """
+        Call the embedder, retrying with exponential backoff
+
+        Args:
+            texts (list[str]): Texts to embed
+
+        Returns:
+            list[list[float]]: One vector per text
+        """
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.wait()
+            start = time.perf_counter()
+            try:
+                vectors = self.embedder.embed_documents(texts)
+                with self.lock:
+                    self.timings["embed"] += time.perf_counter() - start
+                return vectors
+            except Exception as e:
+                if attempt == self.retries:
+                    raise e
+                delay = self.backoff * 2**attempt * (1 + random.random())
+                print(
+                    f"\33[1;33m[Embedding]\33[0m: Errore durante l'embedding ({e}),"
+                    f" nuovo tentativo tra {delay:.1f}s"
+                )
+                time.sleep(delay)
+
+    def add(self, vectorstore: FAISS, chunks):
+        """
+        Embed the chunks and add them to the vectorstore, in order
+
+        Args:
+            vectorstore (FAISS): The vectorstore to fill
+            chunks (Iterable[Document]): Chunks to add
+
+        Yields:
+            list[Document]: Each batch, once it has been added
+        """
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            in_flight = deque()
+            for batch in self.batch(chunks):
+                texts = [render_chunk(c) for c in batch]
+                self.tokens += sum(self.count_tokens(t) for t in texts)
+                in_flight.append((batch, executor.submit(self.embed, texts)))
+                if len(in_flight) >= 2 * self.concurrency:
+                    yield self._insert(vectorstore, *in_flight.popleft())
+            while in_flight:
+                yield self._insert(vectorstore, *in_flight.popleft())
+
+    def _insert(
+        self, vectorstore: FAISS, batch: list[Document], future
+    ) -> list[Document]:
+        vectors = future.result()
+        start = time.perf_counter()
+        vectorstore.add_embeddings(
+            [(c.page_content, vector) for c, vector in zip(batch, vectors)],
+            metadatas=[c.metadata for c in batch],
+            ids=[c.id for c in batch] if all(c.id for c in batch) else None,
+        )
+        self.timings["add"] += time.perf_counter() - start
+        return batch
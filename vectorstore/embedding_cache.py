@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of chunk embeddings, keyed by (embedder model, text hash).
+
+    Each model has its own directory with an append-only float32 matrix
+    (vectors.f32), memory-mapped when loaded, and a key index (keys.txt) with
+    the text hash of each row. Rows are written before their keys, so an
+    interrupted write never leaves a key without its vector. Only the key
+    index is kept in memory: rows added during a run are read back from the
+    file, which is mapped again when a lookup reaches past the mapped rows.
+    """
+
+    def __init__(self, directory: str, model: str):
+        self.directory = os.path.join(directory, re.sub(r"[^\w.-]", "_", model))
+        self.vectors_path = os.path.join(self.directory, "vectors.f32")
+        self.keys_path = os.path.join(self.directory, "keys.txt")
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.model = model
+        self.dim = None
+        self.rows: dict[str, int] = {}
+        self.vectors = None  # memmap of the rows on disk, remapped as it grows
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self.load()
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def load(self):
+        """
+        Map the vectors on disk and read the key index
+        """
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            self.dim = json.load(f)["dim"]
+        keys = []
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "r", encoding="utf-8") as f:
+                keys = f.read().split()
+        size = 0
+        if os.path.exists(self.vectors_path):
+            size = os.path.getsize(self.vectors_path)
+        n_rows = min(len(keys), size // (4 * self.dim))
+        if len(keys) != n_rows or size != n_rows * 4 * self.dim:
+            # Drop the rows of an interrupted write, so the next ones stay aligned
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(n_rows * 4 * self.dim)
+            with open(self.keys_path, "w", encoding="utf-8") as f:
+                f.write("".join(k + "\n" for k in keys[:n_rows]))
+        self.rows = {k: i for i, k in enumerate(keys[:n_rows])}
+        self.map()
+        print(
+            f"\33[1;34m[EmbeddingCache]\33[0m: {n_rows} embedding in cache"
+            f" per il modello {self.model}"
+        )
+
+    def map(self):
+        """
+        Map every row written so far
+        """
+        n_rows = len(self.rows)
+        self.vectors = None
+        if n_rows:
+            self.vectors = np.memmap(
+                self.vectors_path, dtype=np.float32, mode="r", shape=(n_rows, self.dim)
+            )
+
+    def get(self, texts: list[str]) -> list[list[float] | None]:
+        """
+        Look up the embeddings of the texts
+
+        Args:
+            texts (list[str]): Texts to look up
+
+        Returns:
+            list[list[float] | None]: The cached vector of each text, or None
+        """
+        results = []
+        with self.lock:
+            for text in texts:
+                row = self.rows.get(self.key(text))
+                if row is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                if self.vectors is None or row >= len(self.vectors):
+                    self.map()
+                self.hits += 1
+                results.append(self.vectors[row].tolist())
+        return results
+
+    def put(self, texts: list[str], vectors: list[list[float]]):
+        """
+        Add embeddings to the cache
+
+        Args:
+            texts (list[str]): Embedded texts
+            vectors (list[list[float]]): Their vectors
+        """
+        if not texts:
+            return
+        array = np.asarray(vectors, dtype=np.float32)
+        with self.lock:
+            if self.dim is None:
+                self.dim = array.shape[1]
+                with open(self.meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model, "dim": self.dim}, f)
+            added: dict[str, np.ndarray] = {}
+            for text, vector in zip(texts, array):
+                key = self.key(text)
+                if key not in self.rows and key not in added:
+                    added[key] = vector
+            if not added:
+                return
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.stack(list(added.values())).tobytes())
+            with open(self.keys_path, "a", encoding="utf-8") as f:
+                f.write("".join(k + "\n" for k in added))
+            for key in added:
+                self.rows[key] = len(self.rows)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self.rows),
+        }
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+
+from vectorstore.data_manager import Data
+
+
+class Manifest:
+    """
+    Record of the files in the vectorstore: path -> content hash -> chunk ids.
+
+    The hash covers the file content and the split parameters, so a file is
+    re-split when either changes. Size and modification time are kept too:
+    when they did not change the file is not read again to be hashed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: dict[str, dict] = {}
+        self.next_id = 0  # next value of metadata["id"]
+        self.hashes: dict[str, str] = {}  # hashes computed during this run
+
+    def load(self) -> bool:
+        """
+        Load the manifest from disk
+
+        Returns:
+            bool: True if a manifest was found
+        """
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.files = manifest["files"]
+        self.next_id = manifest["next_id"]
+        return True
+
+    def save(self, path: str | None = None):
+        """
+        Write the manifest
+
+        Args:
+            path (str): Destination, defaults to the manifest path
+        """
+        with open(path or self.path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files, "next_id": self.next_id}, f, indent=1)
+
+    @staticmethod
+    def _digest(data: Data):
+        return hashlib.sha256(
+            f"{data.data_type.name}:{data.chunk_size}:{data.chunk_overlap}".encode()
+        )
+
+    @staticmethod
+    def hash_file(path: str, data: Data) -> str:
+        """
+        Hash the content of a file together with its split parameters
+
+        Args:
+            path (str): Path of the file
+            data (Data): The data the file belongs to
+
+        Returns:
+            str: The sha256 hex digest
+        """
+        digest = Manifest._digest(data)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def hash_bytes(raw: bytes, data: Data) -> str:
+        """
+        Same as hash_file(), for the content of a file already read
+
+        Args:
+            raw (bytes): Content of the file
+            data (Data): The data the file belongs to
+
+        Returns:
+            str: The sha256 hex digest
+        """
+        digest = Manifest._digest(data)
+        digest.update(raw)
+        return digest.hexdigest()
+
+    def hash(self, path: str, data: Data) -> str:
+        if path not in self.hashes:
+            self.hashes[path] = self.hash_file(path, data)
+        return self.hashes[path]
+
+    def changed(self, path: str, data: Data) -> bool:
+        """
+        Check whether a file is new or changed since the last build
+
+        Args:
+            path (str): Path of the file
+            data (Data): The data the file belongs to
+
+        Returns:
+            bool: True if the file has to be (re)indexed
+        """
+        entry = self.files.get(path)
+        if entry is None:
+            return True
+        stat = os.stat(path)
+        if (
+            entry["size"] == stat.st_size
+            and entry["mtime"] == stat.st_mtime
+            and entry["params"] == [data.chunk_size, data.chunk_overlap]
+        ):
+            return False
+        if entry["hash"] == self.hash(path, data):
+            entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+            return False
+        return True
+
+    def ids(self, path: str) -> list[str]:
+        entry = self.files.get(path)
+        return list(entry["ids"]) if entry else []
+
+    def set(
+        self, path: str, data: Data, ids: list[str], duplicates_of: list[str] = ()
+    ):
+        """
+        Record the chunks of a file
+
+        Args:
+            path (str): Path of the file
+            data (Data): The data the file belongs to
+            ids (list[str]): Docstore ids of its chunks
+            duplicates_of (list[str]): Ids of the chunks its near-duplicates
+                were collapsed into
+        """
+        stat = os.stat(path)
+        self.files[path] = {
+            "hash": self.hash(path, data),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "params": [data.chunk_size, data.chunk_overlap],
+            "ids": ids,
+            "duplicates_of": sorted(set(duplicates_of)),
+        }
+
+    def remove(self, path: str):
+        self.files.pop(path, None)
+
+    def n_chunks(self) -> int:
+        return sum(len(entry["ids"]) for entry in self.files.values())
@@ -0,0 +1,138 @@
+import glob
+import hashlib
+import heapq
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+SHARDS_FILE = "shards.json"  # number of shards the files were assigned with
+
+# Shared by all the sharded vectorstores, threads are started only when needed
+_executor = ThreadPoolExecutor(thread_name_prefix="faiss-shard")
+
+
+def shard_of(path: str, shards: int) -> int:
+    """
+    Shard a file belongs to, from the hash of its path
+
+    Args:
+        path (str): Path of the file
+        shards (int): Number of shards
+
+    Returns:
+        int: Index of the shard
+    """
+    digest = hashlib.sha256(path.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shards
+
+
+def shard_dir(db_dir: str, shard: int) -> str:
+    return os.path.join(db_dir, f"shard-{shard:02d}")
+
+
+def read_shards(db_dir: str) -> int | None:
+    """
+    Number of shards of the last build of a database
+
+    Args:
+        db_dir (str): Directory of the database
+
+    Returns:
+        int | None: The number of shards, None if it was not recorded
+    """
+    path = os.path.join(db_dir, SHARDS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["shards"]
+
+
+def write_shards(db_dir: str, shards: int):
+    os.makedirs(db_dir, exist_ok=True)
+    with open(os.path.join(db_dir, SHARDS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"shards": shards}, f)
+
+
+def shard_dirs(db_dir: str) -> list[str]:
+    """Directories of the built shards of a database, in shard order."""
+    return sorted(
+        d
+        for d in glob.glob(os.path.join(db_dir, "shard-*"))
+        if os.path.exists(os.path.join(d, "index.faiss"))
+    )
+
+
+class ShardedFAISS(VectorStore):
+    """
+    Read-only vectorstore over several FAISS shards.
+
+    The query is embedded once, every shard is searched in a thread of a
+    pool shared by all instances (FAISS releases the GIL while searching)
+    and the top k hits of all the shards are merged by distance.
+    """
+
+    def __init__(self, shards: list[FAISS], embeddings: Embeddings):
+        self.shards = shards
+        self.embedding = embeddings
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def add_texts(self, texts, metadatas=None, **kwargs: Any) -> list[str]:
+        raise NotImplementedError("ShardedFAISS è in sola lettura")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs: Any):
+        raise NotImplementedError("ShardedFAISS si crea da shard già costruiti")
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: list[float], k: int = 4, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        """
+        Search all the shards and merge their hits
+
+        Args:
+            embedding (list[float]): The query vector
+            k (int): Number of hits to return
+
+        Returns:
+            list[tuple[Document, float]]: The k nearest chunks with their distance
+        """
+        if len(self.shards) == 1:
+            return self.shards[0].similarity_search_with_score_by_vector(
+                embedding, k, **kwargs
+            )
+        results = _executor.map(
+            lambda shard: shard.similarity_search_with_score_by_vector(
+                embedding, k, **kwargs
+            ),
+            self.shards,
+        )
+        return heapq.nsmallest(
+            k, (hit for hits in results for hit in hits), key=lambda hit: hit[1]
+        )
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        embedding = self.embedding.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k, **kwargs)
+
+    def similarity_search_by_vector(
+        self, embedding: list[float], k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        hits = self.similarity_search_with_score_by_vector(embedding, k, **kwargs)
+        return [doc for doc, _ in hits]
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        hits = self.similarity_search_with_score(query, k, **kwargs)
+        return [doc for doc, _ in hits]
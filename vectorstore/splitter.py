@@ -1,39 +1,60 @@
+import glob
+import io
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import (PyPDFDirectoryLoader,
-                                                  TextLoader)
+from langchain_community.document_loaders.parsers.pdf import PyPDFParser
 from langchain_core.documents import Document
+from langchain_core.documents.base import Blob
 
 from vectorstore.data_manager import Data, DataType
+from vectorstore.manifest import Manifest
 
 
 class Splitter:
-    def __init__(self, dir_path: dict):
+    def __init__(self, dir_path: dict, workers: int = 1):
         self.dir_path = dir_path
+        self.workers = workers if workers > 0 else os.cpu_count()
+        self.timings = {"load": 0.0, "split": 0.0}  # seconds, summed over workers
+        self.hashes: dict[str, str] = {}  # path -> content hash, see Manifest
+
+    @staticmethod
+    def read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
 
-    def TextChunks(self, data: Data) -> list[Document]:
+    def TextChunks(
+        self, data: Data, timings: dict | None = None, raw: bytes | None = None
+    ) -> list[Document]:
         try:
             path = data.path
-            loader = TextLoader(path, encoding="utf-8")
-            if data.chunk_size == 0:
-                data.chunk_size = len(
-                    open(path, "r", encoding="utf-8").read()
-                )  # Set chunk size to the length of the document
+            start = time.perf_counter()
+            raw = self.read(path) if raw is None else raw
+            # Same text as TextLoader, newlines included, from the bytes read once
+            text = io.TextIOWrapper(io.BytesIO(raw), encoding="utf-8").read()
+            loaded = [Document(page_content=text, metadata={"source": path})]
+            loaded_at = time.perf_counter()
+            text = loaded[0].page_content if loaded else ""
+            title = text.split("\n", 1)[0].strip()
+            chunk_size = data.chunk_size or max(len(text), 1)  # 0: whole document
             splitter = RecursiveCharacterTextSplitter(
-                chunk_size=data.chunk_size, chunk_overlap=data.chunk_overlap
+                chunk_size=chunk_size, chunk_overlap=data.chunk_overlap
             )
-            loaded = loader.load()
             splits = splitter.split_documents(loaded)
             new_splits = []
             for s in splits:
-                title = open(path, "r", encoding="utf-8").readline().strip()
-                s.metadata["title"] = title
-                source = data.path
-                content = s.page_content
-                if title == content and len(splits) > 1:
+                if title == s.page_content and len(splits) > 1:
                     continue  # Skip if title is the same as content and there are multiple chunks
-                final_content = f"\\TITLE: {title}\\SOURCE: {source}\\BODY: {content}"
-                s.page_content = final_content
+                # Title and source stay in metadata, see utilities.chunks.render_chunk
+                s.metadata["title"] = title
+                s.metadata["source"] = data.path
                 new_splits.append(s)
+            if timings is not None:
+                timings["load"] = loaded_at - start
+                timings["split"] = time.perf_counter() - loaded_at
             print(
                 f"\33[1;32m[Splitter]\33[0m: Creati {len(new_splits)} chunks di tipo Text per",
                 data.path,
@@ -45,47 +66,149 @@ class Splitter:
             )
             raise e
 
-    def PDFChunks(self, data: Data) -> list[Document]:
+    def PDFChunks(
+        self,
+        data: Data,
+        path: str,
+        timings: dict | None = None,
+        raw: bytes | None = None,
+    ) -> list[Document]:
         try:
-            path = data.path
-            loader = PyPDFDirectoryLoader(path)
+            start = time.perf_counter()
+            raw = self.read(path) if raw is None else raw
             splitter = RecursiveCharacterTextSplitter(
                 chunk_size=data.chunk_size, chunk_overlap=data.chunk_overlap
             )
-            loaded = loader.load()
+            # What PyPDFLoader does, from the bytes read once
+            loaded = list(PyPDFParser().lazy_parse(Blob.from_data(raw, path=path)))
+            loaded_at = time.perf_counter()
             splits = splitter.split_documents(loaded)
+            if timings is not None:
+                timings["load"] = loaded_at - start
+                timings["split"] = time.perf_counter() - loaded_at
             print(
                 f"\33[1;32m[Splitter]\33[0m: Creati {len(splits)} chunks di tipo PDF per",
-                data.path,
+                path,
             )
             return splits
         except Exception as e:
             print(
-                f"\33[1;31m[Splitter]\33[0m: Errore durante la creazione dei chunks di tipo PDF di {data.path}: {e}"
+                f"\33[1;31m[Splitter]\33[0m: Errore durante la creazione dei chunks di tipo PDF di {path}: {e}"
             )
             raise e
 
-    def create_chunks(self, data: list[Data]) -> list[Document]:
+    def tasks(self, data: list[Data]):
         """
-        Create chunks of given data
+        Expand the data into one task per file, in a deterministic order
 
         Args:
             data (list[Data]): List of data
 
-        Returns:
-            list[Document]: List of chunks
+        Yields:
+            tuple[Data, str]: The data and the path of a single file
         """
-        chunks = []
-
         for d in data:
             if d.data_type == DataType.TEXT:
-                chunks += self.TextChunks(d)
+                yield d, d.path
             else:
-                chunks += self.PDFChunks(d)
+                pattern = os.path.join(d.path, "**", "[!.]*.pdf")
+                for path in sorted(glob.glob(pattern, recursive=True)):
+                    yield d, path
+
+    def split_file(self, task: tuple[Data, str]) -> list[Document]:
+        """
+        Load and split a single file
 
-        # Assign unique IDs to each chunk
-        for i, chunk in enumerate(chunks):
-            chunk.metadata["id"] = i
+        Args:
+            task (tuple[Data, str]): The data and the path of the file
 
-        print(f"\33[1;32m[Splitter]\33[0m: Creati {len(chunks)} chunks totali")
+        Returns:
+            list[Document]: Chunks of the file
+        """
+        return self._split_timed(task)[0]
+
+    def _split_timed(
+        self, task: tuple[Data, str]
+    ) -> tuple[list[Document], dict, str]:
+        # Timings and hash travel back with the chunks, since workers are processes.
+        # The file is hashed from the bytes it is split from, so it is read once.
+        data, path = task
+        timings = {}
+        start = time.perf_counter()
+        raw = self.read(path)
+        file_hash = Manifest.hash_bytes(raw, data)
+        read_seconds = time.perf_counter() - start
+        if data.data_type == DataType.TEXT:
+            chunks = self.TextChunks(data, timings, raw)
+        else:
+            chunks = self.PDFChunks(data, path, timings, raw)
+        timings["load"] = timings.get("load", 0.0) + read_seconds
+        return chunks, timings, file_hash
+
+    def _collect(
+        self, path: str, result: tuple[list[Document], dict, str]
+    ) -> list[Document]:
+        chunks, timings, file_hash = result
+        for stage, seconds in timings.items():
+            self.timings[stage] += seconds
+        self.hashes[path] = file_hash
         return chunks
+
+    def split_files(self, tasks):
+        """
+        Load and split the files, in parallel when more than one worker is set.
+        Results are returned in the same order as the tasks, and at most twice
+        as many files as workers are kept in flight. The content hash of each
+        file is left in self.hashes.
+
+        Args:
+            tasks (Iterable[tuple[Data, str]]): Files to split, see tasks()
+
+        Yields:
+            list[Document]: Chunks of each file
+        """
+        if self.workers <= 1:
+            for task in tasks:
+                yield self._collect(task[1], self._split_timed(task))
+            return
+        with ProcessPoolExecutor(self.workers) as executor:
+            futures = deque()
+            for task in tasks:
+                futures.append((task[1], executor.submit(self._split_timed, task)))
+                if len(futures) >= 2 * self.workers:
+                    path, future = futures.popleft()
+                    yield self._collect(path, future.result())
+            while futures:
+                path, future = futures.popleft()
+                yield self._collect(path, future.result())
+
+    def iter_chunks(self, data: list[Data]):
+        """
+        Stream the chunks of given data, file by file
+
+        Args:
+            data (list[Data]): List of data
+
+        Yields:
+            Document: Chunks with a unique, sequential id
+        """
+        i = 0
+        for file_chunks in self.split_files(self.tasks(data)):
+            # Ids are assigned after merging, independently of the workers
+            for chunk in file_chunks:
+                chunk.metadata["id"] = i
+                i += 1
+                yield chunk
+        print(f"\33[1;32m[Splitter]\33[0m: Creati {i} chunks totali")
+
+    def create_chunks(self, data: list[Data]) -> list[Document]:
+        """
+        Create chunks of given data
+
+        Args:
+            data (list[Data]): List of data
+
+        Returns:
+            list[Document]: List of chunks
+        """
+        return list(self.iter_chunks(data))
@@ -1,17 +1,48 @@
+import argparse
+import glob
 import os
+import shutil
 
 import faiss
 from dotenv import find_dotenv, load_dotenv
 from langchain_cohere import CohereEmbeddings
 from langchain_community.docstore import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
 
+from vectorstore.benchmark import print_report, run_benchmark, save_report
 from vectorstore.data_manager import DataList
 from vectorstore.db_maker import DBMaker
+from vectorstore.sharding import read_shards, shard_dir, write_shards
+from utilities.providers import HashingEmbeddings
 from utilities.utilities import load_config
 
 
+def new_vectorstore(embedder: Embeddings, dim: int) -> FAISS:
+    return FAISS(
+        embedding_function=embedder,
+        index=faiss.IndexFlatL2(dim),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Creazione del database vettoriale")
+    parser.add_argument(
+        "--shards",
+        type=int,
+        nargs="+",
+        help="ricostruisce solo gli shard indicati (default: tutti)",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="misura una build completa con embedding locali, database escluso",
+    )
+    parser.add_argument("--output", help="file JSON per il report del benchmark")
+    args = parser.parse_args()
+
     os.system("cls" if os.name == "nt" else "clear")
     print("\33[1;34m[Main]\33[0m: Avvio dello script di creazione database")
 
@@ -30,19 +61,56 @@ def main():
         return
     data = data_list.get_data()
 
-    embedder = CohereEmbeddings(model=config["embedder"])
+    if args.benchmark:
+        report = run_benchmark(config, data)
+        print_report(report)
+        if args.output:
+            save_report(report, args.output)
+            print(f"\33[1;32m[Main]\33[0m: Report salvato in {args.output}")
+        return
 
-    index = faiss.IndexFlatL2(len(embedder.embed_query("index")))
-    vectorstore = FAISS(
-        embedding_function=embedder,
-        index=index,
-        docstore=InMemoryDocstore(),
-        index_to_docstore_id={},
-    )
+    if config.get("provider", "cohere") == "hashing":
+        embedder = HashingEmbeddings(config["hashing_dim"])
+        config["embedder"] = f"hashing-{config['hashing_dim']}"  # Own cache entries
+    else:
+        embedder = CohereEmbeddings(model=config["embedder"])
+
+    dim = len(embedder.embed_query("index"))
+    db_dir = config["paths"]["db"]
+    shards = config["sharding"]["shards"]
+
+    if shards <= 1:
+        for path in glob.glob(os.path.join(db_dir, "shard-*")):
+            shutil.rmtree(path)  # Shards of a previous sharded build
+        DBMaker(config, new_vectorstore(embedder, dim)).make(data)
+        write_shards(db_dir, 1)
+        print("\33[1;32m[Main]\33[0m: Database creato")
+        return
+
+    previous = read_shards(db_dir)
+    if previous is None and glob.glob(os.path.join(db_dir, "shard-*")):
+        previous = 0  # Shards of a build that did not record their number
+    if args.shards is not None and previous is not None and previous != shards:
+        # The files are assigned to other shards: rebuilding only some of them
+        # would leave the files that moved indexed in their old shard too
+        print(
+            f"\33[1;31m[Main]\33[0m: Il database esistente non ha {shards} shard,"
+            " ricostruire tutti gli shard senza --shards"
+        )
+        return
 
-    db_maker = DBMaker(config, vectorstore)
-    db_maker.make(data)
-    print("\33[1;32m[Main]\33[0m: Database creato")
+    valid = {shard_dir(db_dir, i) for i in range(shards)}
+    for path in glob.glob(os.path.join(db_dir, "shard-*")):
+        if path not in valid:
+            shutil.rmtree(path)  # Shards beyond the configured number
+    for i in args.shards if args.shards is not None else range(shards):
+        if not 0 <= i < shards:
+            print(f"\33[1;31m[Main]\33[0m: Shard {i} inesistente (0-{shards - 1})")
+            continue
+        print(f"\33[1;34m[Main]\33[0m: Creazione dello shard {i + 1}/{shards}")
+        DBMaker(config, new_vectorstore(embedder, dim), shard=i).make(data)
+    write_shards(db_dir, shards)
+    print(f"\33[1;32m[Main]\33[0m: Database creato in {shards} shard")
 
 
 if __name__ == "__main__":